@@ -9,7 +9,7 @@ echo 'Installing packages...'
 ./venv/bin/pip -q install --download-cache "${HOME}/bundles/${JOB_NAME}" -r requirements.txt
 
 echo 'Updating data...'
-./venv/bin/python -m stats.main
+./venv/bin/python -m stats.main run
 
 echo 'Done'
 rm -rf ./venv
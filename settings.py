@@ -3,36 +3,120 @@ import os
 import sys
 
 
-DATA_DOMAIN = os.environ.get(
-    'PP_DATA_DOMAIN',
-    'https://www.performance.service.gov.uk/data'
-)
-PP_TOKEN = os.environ.get('PP_DATASET_TOKEN', None)
+DEFAULT_DATA_DOMAIN = 'https://www.performance.service.gov.uk/data'
+
+# These are resolved from the environment by load(), so that importing this
+# module has no side effects; the values here are the defaults.
+DATA_DOMAIN = DEFAULT_DATA_DOMAIN
+PP_TOKEN = None
+LOG_LEVEL = 'INFO'
+# A directory to write per-stage profiles to, or None to not profile
+PROFILE_DIR = None
+# A file to remember the paths with no pageviews in, or None to not skip them
+EMPTY_PATHS_FILENAME = None
+# The comma-separated rules to canonicalise paths by before fetching pageviews
+# (see stats.canonical), 'all', or None to leave the paths as they are
+CANONICALIZE_PATHS = None
 
 DATA_GROUP = 'govuk-info'
 DAYS = 42
 RESULTS_DATASET = 'info-statistics'
 
+# The most datapoints to hold in memory while aggregating before spilling them
+# to disk, or None for no limit. This only bounds the datapoints: the fetched
+# counts, pageviews and priorities, and the POST, still hold every path
+AGGREGATION_MAX_ENTRIES = None
+
+# Known-empty paths (see EMPTY_PATHS_FILENAME) are skipped for this many days,
+# except for a random sample of this proportion of them which is rechecked
+EMPTY_PATHS_EXPIRY_DAYS = 14
+EMPTY_PATHS_RECHECK_RATE = 0.05
+
+# Long-tail estimation (off unless ESTIMATE_LONG_TAIL or --estimate-long-tail):
+# pageviews are only fetched exactly for paths with more than
+# ESTIMATION_THRESHOLD problem reports and searches; of the rest, a sample of
+# ESTIMATION_SAMPLE_RATE is fetched and the others are flagged, with no
+# pageviews, and a range covering ESTIMATION_CONFIDENCE percent of the sampled
+# paths with the same counts in the CSV report
+ESTIMATE_LONG_TAIL = False
+ESTIMATION_THRESHOLD = 2
+ESTIMATION_SAMPLE_RATE = 0.1
+ESTIMATION_CONFIDENCE = 90
+
+# Hedged requests: once there are HEDGE_MIN_SAMPLES latencies for a dataset, a
+# GET which takes longer than their HEDGE_PERCENTILE (and at least
+# HEDGE_MIN_SECONDS) is sent again, and the first response is used
+HEDGE_REQUESTS = True
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_SECONDS = 1.0
+
+# Circuit breakers: once CIRCUIT_BREAKER_MIN_REQUESTS have been made to a
+# dataset and at least CIRCUIT_BREAKER_ERROR_RATE of its recent requests have
+# failed, fail fast for CIRCUIT_BREAKER_RESET_SECONDS before trying again
+CIRCUIT_BREAKER = True
+CIRCUIT_BREAKER_ERROR_RATE = 0.5
+CIRCUIT_BREAKER_MIN_REQUESTS = 10
+CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# Daemon mode: seconds between the starts of runs, seconds to keep the list of
+# smart answers for, and where to serve the status and results. Each run
+# covers the DAYS up to midnight UTC, so the previous run's pageviews are only
+# reused by runs on the same day: the interval needs to be under a day for
+# them (and the smart answers) to be reused at all
+DAEMON_INTERVAL = 6 * 60 * 60
+DAEMON_SMART_ANSWERS_TTL = 24 * 60 * 60
+DAEMON_HOST = '127.0.0.1'
+DAEMON_PORT = 8080
+
 
 REPORT_FILENAME = 'report_{}_{}.csv'
+PATH_VARIANTS_FILENAME = 'path_variants_{}_{}.csv'
+
+
+def load(environ=None):
+    """
+    Resolve the settings which come from environment variables.
+
+    This is called explicitly by the command line entry point; code embedding
+    the stats package can call it (optionally with its own mapping) or leave the
+    defaults in place.
+    """
+    global DATA_DOMAIN, PP_TOKEN, LOG_LEVEL, PROFILE_DIR, EMPTY_PATHS_FILENAME
+    global AGGREGATION_MAX_ENTRIES, ESTIMATE_LONG_TAIL, CANONICALIZE_PATHS
+
+    if environ is None:
+        environ = os.environ
+
+    DATA_DOMAIN = environ.get('PP_DATA_DOMAIN', DEFAULT_DATA_DOMAIN)
+    PP_TOKEN = environ.get('PP_DATASET_TOKEN', None)
+    LOG_LEVEL = environ.get('LOG_LEVEL', 'INFO').upper()
+    PROFILE_DIR = environ.get('PROFILE_DIR', None)
+    EMPTY_PATHS_FILENAME = environ.get('EMPTY_PATHS_FILENAME', None)
+    CANONICALIZE_PATHS = environ.get('CANONICALIZE_PATHS', None)
+    if environ.get('AGGREGATION_MAX_ENTRIES'):
+        AGGREGATION_MAX_ENTRIES = int(environ['AGGREGATION_MAX_ENTRIES'])
+    if environ.get('ESTIMATE_LONG_TAIL'):
+        ESTIMATE_LONG_TAIL = environ['ESTIMATE_LONG_TAIL'].lower() in ('1', 'true', 'yes')
 
 
-LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
-logging_level = getattr(logging, LOG_LEVEL)
+def configure_logging(log_level=None):
+    log_level = (log_level or LOG_LEVEL).upper()
+    logging_level = getattr(logging, log_level)
 
-# Use the root logger in DEBUG so that we get logged output from the performance
-# platform client; otherwise only use the logger for the stats package
-if LOG_LEVEL == 'DEBUG':
-    logger = logging.getLogger()
-else:
-    logger = logging.getLogger('stats')
+    # Use the root logger in DEBUG so that we get logged output from the performance
+    # platform client; otherwise only use the logger for the stats package
+    if log_level == 'DEBUG':
+        logger = logging.getLogger()
+    else:
+        logger = logging.getLogger('stats')
 
-logger.setLevel(logging_level)
+    logger.setLevel(logging_level)
 
-handler = logging.StreamHandler(stream=sys.stdout)
-handler.setLevel(logging_level)
+    handler = logging.StreamHandler(stream=sys.stdout)
+    handler.setLevel(logging_level)
 
-formatter = logging.Formatter(fmt='%(asctime)s %(message)s')
-handler.setFormatter(formatter)
+    formatter = logging.Formatter(fmt='%(asctime)s %(message)s')
+    handler.setFormatter(formatter)
 
-logger.addHandler(handler)
+    logger.addHandler(handler)
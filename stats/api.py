@@ -1,12 +1,14 @@
 import copy
 import itertools
 import logging
-import string
+import time
 
-from performanceplatform.client import DataSet
-import requests
-
-from .data import SmartAnswer
+from . import metrics
+from .cassette import Cassette, CassetteResponse
+from .data import Datapoint, SmartAnswer
+from .planning import MetricFetchPlan, PageviewFetchPlan
+from .profiling import Profiler
+from .resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged_call
 import settings
 
 
@@ -21,63 +23,190 @@ class PerformancePlatform(object):
     handling GET and POST requests up to five times, if their status
     codes are 502 or 503. If they still don't succeed, the client
     raises an exception that is not handled by us.
+
+    With dry_run, the client logs the POST of the aggregated results
+    instead of sending it. With a cassette, GETs are recorded to it or
+    replayed from it (see stats.cassette).
+
+    GETs which take longer than a high percentile of the recent latencies
+    for their dataset are hedged with a duplicate request, and each dataset
+    has a circuit breaker which fails fast once too many of its requests
+    fail (see stats.resilience and the HEDGE_ and CIRCUIT_BREAKER_ settings).
+    Requests which fail or hit an open circuit are deferred and retried once
+    the circuit lets a request through again (see _fetch_with_retry).
     """
 
     date_format = "%Y-%m-%dT00:00:00Z"
 
-    def __init__(self, pp_token, start_date, end_date):
+    def __init__(self, pp_token, start_date, end_date, dry_run=False, cassette=None):
         self.pp_token = pp_token
+        self.dry_run = dry_run
+        self.cassette = cassette
         # Format dates here so that they won't be accidentally used as
         # non-midnight datetimes elsewhere in the class:
         self.start_date = start_date.strftime(self.date_format)
         self.end_date = end_date.strftime(self.date_format)
+        self.latency_trackers = {}
+        self.circuit_breakers = {}
+
+    def get_metric_counts(self, metrics_to_fetch=None, profiler=None):
+        """
+        Get the counts by path for the metrics fetched by letter (all of the
+        registered ones by default), as a dict of {field: {path: count}}.
+
+        Metrics from the same dataset share one fan-out of queries (see
+        MetricFetchPlan). With a Profiler, each dataset's queries are
+        profiled as a stage of their own, such as `counts_search_terms`.
+        """
+        if profiler is None:
+            profiler = Profiler()
+        if metrics_to_fetch is None:
+            metrics_to_fetch = metrics.fetched_by_letter()
+        plan = MetricFetchPlan(metrics_to_fetch)
+        logger.info('Getting counts for %s with %d requests',
+                    ', '.join(metric.field for metric in metrics_to_fetch), plan.request_count)
+
+        counts = {metric.field: {} for metric in metrics_to_fetch}
+
+        def fetch(query):
+            dataset_name, dataset_metrics, prefix = query
+            collect = [metric.collect for metric in dataset_metrics]
+            results = self._get_pp_data(dataset_name,
+                                        collect[0] if len(collect) == 1 else collect,
+                                        filter_by_prefix=prefix)
+            for result in results:
+                path = result['pagePath'].encode('utf-8')
+                for metric in dataset_metrics:
+                    counts[metric.field][path] = result.get(metric.collect)
+
+        # The counts are incomplete without every query, so a query which
+        # still fails after being retried fails the run
+        for dataset_name, queries in itertools.groupby(plan.queries(), lambda query: query[0]):
+            with profiler.stage('counts_' + dataset_name.replace('-', '_')):
+                failed = self._fetch_with_retry(dataset_name, list(queries), fetch)
+            if failed:
+                raise failed[0][1]
+        return counts
 
     def get_problem_report_counts(self):
-        logger.info('Getting problem report counts')
-        results_by_letter = [self._get_problem_report_counts_for_paths_starting_with('/' + letter)
-                             for letter in string.lowercase]
-        all_results = list(itertools.chain(*results_by_letter))
-        return {result["pagePath"].encode('utf-8'): result["total:sum"]
-                for result in all_results}
+        field = metrics.PROBLEM_REPORTS.field
+        return self.get_metric_counts([metrics.PROBLEM_REPORTS])[field]
 
     def get_search_counts(self):
-        logger.info('Getting search counts')
-        results_by_letter = [self._get_search_counts_for_paths_starting_with('/' + letter)
-                             for letter in string.lowercase]
-        all_results = list(itertools.chain(*results_by_letter))
-        return {result["pagePath"].encode('utf-8'): result["searchUniques:sum"]
-                for result in all_results}
-
-    def get_unique_pageviews(self, paths):
+        field = metrics.SEARCHES.field
+        return self.get_metric_counts([metrics.SEARCHES])[field]
+
+    def get_unique_pageviews(self, paths, smart_answers=(), priorities=None, deadline=None):
+        """
+        Get pageviews for the paths, with a single prefix query for all of the
+        paths under each smart answer (see PageviewFetchPlan).
+
+        Requests are made in order of the paths' priorities, highest first. If
+        a deadline (a time.time() value) is given, no requests are started
+        after it, and the paths which weren't fetched are left out of the
+        results.
+        """
         logger.info('Getting pageview counts')
-        return {path: self.get_unique_pageviews_for_path(path) for path in paths}
+        plan = PageviewFetchPlan(paths, smart_answers, priorities)
+        logger.info('Fetching pageviews for %d paths with %d requests',
+                    plan.path_count, plan.request_count)
+
+        pageviews = {}
+
+        def fetch(planned_fetch):
+            prefix, fetch_paths = planned_fetch
+            if prefix is None:
+                pageviews[fetch_paths[0]] = self.get_unique_pageviews_for_path(fetch_paths[0])
+            else:
+                pageviews_by_path = self.get_unique_pageviews_for_paths_starting_with(prefix)
+                for path in fetch_paths:
+                    pageviews[path] = pageviews_by_path.get(path)
+
+        failed = self._fetch_with_retry(metrics.PAGEVIEWS.dataset, plan.fetches, fetch, deadline)
+        for (prefix, fetch_paths), error in failed:
+            logger.error('Failed to get pageviews for %s: %s', prefix or fetch_paths[0], error)
+
+        if len(pageviews) < len(paths):
+            logger.warning('Left pageviews unfetched for %d paths, because of the deadline '
+                           'or failed requests', len(paths) - len(pageviews))
+        return pageviews
+
+    def _fetch_with_retry(self, dataset_name, queries, fetch, deadline=None):
+        """
+        Call fetch for each of the queries to a dataset, in order, until the
+        deadline (a time.time() value).
+
+        A query which fails, or which hits the dataset's open circuit, is
+        deferred, and retried once the rest have been made and the circuit
+        lets a request through again. So a run carries on past occasional
+        failures, and once enough requests fail to open the circuit, the rest
+        are deferred without being made. Returns the (query, exception) pairs
+        which failed again; if the circuit is still open (and there's no
+        deadline, by which they'd be left unfetched) CircuitOpenError is
+        raised. Without a circuit breaker, failures are raised straight away.
+        """
+        deferred = self._fetch_each(queries, fetch, deadline)
+        if not deferred:
+            return []
+
+        logger.warning('Deferred %d failed %s requests to retry', len(deferred), dataset_name)
+        circuit_breaker = self._circuit_breaker(dataset_name)
+        wait = circuit_breaker.seconds_until_retry()
+        if deadline is not None:
+            wait = min(wait, max(0, deadline - time.time()))
+        time.sleep(wait)
+
+        failed = self._fetch_each([query for query, _ in deferred], fetch, deadline)
+        if deadline is None and any(isinstance(error, CircuitOpenError) for _, error in failed):
+            raise CircuitOpenError(dataset_name, circuit_breaker.seconds_until_retry())
+        return failed
+
+    @staticmethod
+    def _fetch_each(queries, fetch, deadline):
+        # Only failed requests are deferred (the PP client raises the requests
+        # exceptions): anything else is a bug, which should fail the run
+        import requests
+
+        failed = []
+        for query in queries:
+            if deadline is not None and time.time() >= deadline:
+                break
+            try:
+                fetch(query)
+            except CircuitOpenError as e:
+                failed.append((query, e))
+            except requests.exceptions.RequestException as e:
+                if not settings.CIRCUIT_BREAKER:
+                    raise
+                logger.warning('Request failed, deferring it: %s', e)
+                failed.append((query, e))
+        return failed
 
     def get_unique_pageviews_for_path(self, path):
-        data = self._get_pp_data('page-statistics', 'uniquePageviews:sum',
-                                 filter_by=path)
-        if data and data[0]['uniquePageviews:sum']:
-            return int(data[0]['uniquePageviews:sum'])
+        collect = metrics.PAGEVIEWS.collect
+        data = self._get_pp_data(metrics.PAGEVIEWS.dataset, collect, filter_by=path)
+        if data and data[0][collect]:
+            return int(data[0][collect])
+
+    def get_unique_pageviews_for_paths_starting_with(self, path_prefix):
+        collect = metrics.PAGEVIEWS.collect
+        data = self._get_pp_data(metrics.PAGEVIEWS.dataset, collect,
+                                 filter_by_prefix=path_prefix)
+        return {result['pagePath'].encode('utf-8'): int(result[collect])
+                for result in data if result[collect]}
 
     def save_aggregated_results(self, results):
-        data_set = DataSet.from_group_and_type(settings.DATA_DOMAIN,
-                                               settings.DATA_GROUP,
-                                               settings.RESULTS_DATASET,
-                                               token=self.pp_token)
+        # The results are POSTed in a single request, so that the dataset is
+        # never partly updated; this means they're all in memory for the POST
+        data_set = self._data_set(settings.RESULTS_DATASET, token=self.pp_token,
+                                  dry_run=self.dry_run)
         enriched_results = [self._enrich_mandatory_pp_fields(result)
                             for result in results]
         logger.info('Posting data to Performance Platform')
         data_set.post(enriched_results)
 
-    def _get_problem_report_counts_for_paths_starting_with(self, path_prefix):
-        return self._get_pp_data('page-contacts', 'total:sum',
-                                 filter_by_prefix=path_prefix)
-
-    def _get_search_counts_for_paths_starting_with(self, path_prefix):
-        return self._get_pp_data('search-terms', 'searchUniques:sum',
-                                 filter_by_prefix=path_prefix)
-
     def _enrich_mandatory_pp_fields(self, result):
-        enriched_result = copy.copy(result.as_dict())
+        enriched_result = copy.copy(result.as_dict(Datapoint.posted_fields))
         enriched_result['_timestamp'] = self.end_date
         enriched_result['_start_at'] = self.start_date
         enriched_result['_end_at'] = self.end_date
@@ -85,9 +214,6 @@ class PerformancePlatform(object):
 
     def _get_pp_data(self, dataset_name, value,
                      filter_by=None, filter_by_prefix=None):
-        dataset = DataSet.from_group_and_type(settings.DATA_DOMAIN,
-                                              settings.DATA_GROUP,
-                                              dataset_name)
         query_parameters = {
             'group_by': 'pagePath',
             'period': 'day',
@@ -101,18 +227,93 @@ class PerformancePlatform(object):
             query_parameters['filter_by_prefix'] = 'pagePath:' + filter_by_prefix
 
         logger.debug('Getting {0} data with params {1}'.format(dataset_name, query_parameters))
-        json_data = dataset.get(query_parameters)
+        json_data = self._get_json(dataset_name, query_parameters)
 
         if 'data' in json_data:
             return json_data['data']
         else:
             return []
 
+    def _get_json(self, dataset_name, query_parameters):
+        if self.cassette is None:
+            return self._get_json_from_pp(dataset_name, query_parameters)
+
+        key = Cassette.key(dataset_name, query_parameters)
+        if self.cassette.replaying:
+            return self.cassette.replay(key)
+
+        json_data = self._get_json_from_pp(dataset_name, query_parameters)
+        self.cassette.record(key, json_data)
+        return json_data
+
+    def _get_json_from_pp(self, dataset_name, query_parameters):
+        circuit_breaker = self._circuit_breaker(dataset_name)
+        if circuit_breaker is not None:
+            circuit_breaker.before_request()
+
+        latency_tracker = self.latency_trackers.setdefault(dataset_name, LatencyTracker())
+        hedge_after = None
+        if settings.HEDGE_REQUESTS and len(latency_tracker) >= settings.HEDGE_MIN_SAMPLES:
+            hedge_after = max(latency_tracker.percentile(settings.HEDGE_PERCENTILE),
+                              settings.HEDGE_MIN_SECONDS)
+
+        def get():
+            started = time.time()
+            json_data = self._data_set(dataset_name).get(query_parameters)
+            latency_tracker.record(time.time() - started)
+            return json_data
+
+        try:
+            json_data = hedged_call(get, hedge_after)
+        except Exception:
+            if circuit_breaker is not None:
+                circuit_breaker.record_failure()
+            raise
+
+        if circuit_breaker is not None:
+            circuit_breaker.record_success()
+        return json_data
+
+    def _circuit_breaker(self, dataset_name):
+        if not settings.CIRCUIT_BREAKER:
+            return None
+        if dataset_name not in self.circuit_breakers:
+            self.circuit_breakers[dataset_name] = CircuitBreaker(
+                dataset_name,
+                error_rate=settings.CIRCUIT_BREAKER_ERROR_RATE,
+                min_requests=settings.CIRCUIT_BREAKER_MIN_REQUESTS,
+                reset_seconds=settings.CIRCUIT_BREAKER_RESET_SECONDS)
+        return self.circuit_breakers[dataset_name]
+
+    @staticmethod
+    def _data_set(dataset_name, token=None, dry_run=False):
+        # Imported here so that the client (and requests) are only loaded
+        # when we actually talk to the Performance Platform
+        from performanceplatform.client import DataSet
+
+        return DataSet.from_group_and_type(settings.DATA_DOMAIN,
+                                           settings.DATA_GROUP,
+                                           dataset_name,
+                                           token=token,
+                                           dry_run=dry_run)
+
 
 class GOVUK(object):
+    """
+    Gets data from GOV.UK's search API.
+
+    A requests session can be passed in to reuse its connection pool across
+    calls.
+    """
+
+    def __init__(self, cassette=None, session=None):
+        self.cassette = cassette
+        self.session = session
 
     def get_smart_answers(self):
         """Get all smart answers, from the Search API."""
+        import requests
+
         logger.info('Getting smart answers')
 
         smart_answers = []
@@ -121,7 +322,7 @@ class GOVUK(object):
         url += '&filter_format=simple_smart_answer'
         url += '&start=0&count=1000&fields=link'
         try:
-            r = requests.get(url)
+            r = self._get(url)
             if r.status_code == 200:
                 results = r.json()['results']
                 return [SmartAnswer(result['link'].encode('utf-8')) for result in results]
@@ -130,3 +331,36 @@ class GOVUK(object):
                              r.status_code, url)
         except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
             logger.error('Failed to get smartanswers from %s: %s', url, str(e))
+
+    def _get(self, url):
+        import requests
+
+        get = self.session.get if self.session is not None else requests.get
+
+        if self.cassette is None:
+            return get(url)
+
+        # Failed requests are recorded too, and raised again when they're
+        # replayed, so that a replayed run fails in the same way; a request
+        # missing from the cassette fails like a connection error
+        key = Cassette.key(url)
+        if self.cassette.replaying:
+            try:
+                interaction = self.cassette.replay(key)
+            except KeyError as e:
+                raise requests.exceptions.ConnectionError(str(e))
+            if 'error' in interaction:
+                error_class = getattr(requests.exceptions, interaction['error'])
+                raise error_class(interaction['message'])
+            return CassetteResponse(**interaction)
+
+        try:
+            r = get(url)
+        except (requests.exceptions.ConnectionError, requests.exceptions.HTTPError) as e:
+            self.cassette.record(key, {'error': type(e).__name__, 'message': str(e)})
+            raise
+        self.cassette.record(key, {
+            'status_code': r.status_code,
+            'json_data': r.json() if r.status_code == 200 else None,
+        })
+        return r
@@ -0,0 +1,129 @@
+import logging
+import re
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# The normalisation rules, in the order they're applied
+FRAGMENT = 'fragment'
+QUERY_STRING = 'query_string'
+PERCENT_ENCODING = 'percent_encoding'
+CASE = 'case'
+TRAILING_SLASH = 'trailing_slash'
+
+RULES = [FRAGMENT, QUERY_STRING, PERCENT_ENCODING, CASE, TRAILING_SLASH]
+
+# Escapes which are left encoded, because decoding them would change how the
+# path is split up
+RESERVED_ESCAPES = set('/?#%')
+
+ESCAPE = re.compile('%([0-9A-Fa-f]{2})')
+
+# An escaped UTF-8 character (which may still be invalid, if it's overlong), or
+# any other escape
+CONTINUATION_ESCAPE = '%[89ABab][0-9A-Fa-f]'
+CHARACTER_ESCAPE = re.compile('|'.join([
+    '%[0-7][0-9A-Fa-f]',
+    '%[CDcd][0-9A-Fa-f]' + CONTINUATION_ESCAPE,
+    '%[Ee][0-9A-Fa-f]' + CONTINUATION_ESCAPE * 2,
+    '%[Ff][0-7]' + CONTINUATION_ESCAPE * 3,
+    '%[0-9A-Fa-f]{2}',
+]))
+
+
+def parse_rules(rules):
+    """Parse a comma-separated list of rules, or 'all'."""
+    if rules.strip().lower() == 'all':
+        return list(RULES)
+    return [rule.strip() for rule in rules.split(',') if rule.strip()]
+
+
+class PathCanonicalizer(object):
+    """
+    Merge the variants of a path onto one canonical path.
+
+    The pagePaths of problem reports and searches include variants of the same
+    page, each of which would otherwise be a datapoint and a pageview request
+    of its own. Each rule removes one kind of variation:
+    - fragment: drop anything from '#'
+    - query_string: drop anything from '?'
+    - percent_encoding: decode escaped characters (apart from those in
+      RESERVED_ESCAPES, and those which aren't valid UTF-8, whose escapes are
+      upper-cased)
+    - case: lower-case the path (but not its escapes)
+    - trailing_slash: drop trailing slashes, apart from the root's
+
+    The variants merged onto each canonical path are kept in `variants`, for
+    auditing.
+    """
+
+    def __init__(self, rules=RULES):
+        unknown_rules = set(rules) - set(RULES)
+        if unknown_rules:
+            raise ValueError('Unknown path canonicalisation rules: {0}'.format(
+                ', '.join(sorted(unknown_rules))))
+
+        self.rules = [rule for rule in RULES if rule in rules]
+        self.variants = {}
+
+    def canonicalize(self, path):
+        if FRAGMENT in self.rules:
+            path = path.split('#', 1)[0]
+        if QUERY_STRING in self.rules:
+            path = path.split('?', 1)[0]
+        if PERCENT_ENCODING in self.rules:
+            path = CHARACTER_ESCAPE.sub(self._decode_escape, path)
+        if CASE in self.rules:
+            path = ESCAPE.sub(self._upper_case_escape, path.lower())
+        if TRAILING_SLASH in self.rules:
+            path = path.rstrip('/') or '/'
+        return path
+
+    def merge_counts(self, counts):
+        """
+        Merge the counts by path of each metric, as returned by
+        PerformancePlatform.get_metric_counts, onto the canonical paths. The
+        counts of a path's variants are combined as the metric's are for a
+        smart answer.
+        """
+        variants = {}
+        for counts_by_path in counts.itervalues():
+            for path in counts_by_path:
+                variants.setdefault(self.canonicalize(path), set()).add(path)
+        self.variants = {canonical_path: sorted(paths)
+                         for canonical_path, paths in variants.iteritems()}
+
+        merged_counts = {}
+        for field, counts_by_path in counts.iteritems():
+            combine = metrics.by_field(field).combine
+            counts_by_canonical_path = {}
+            for path, count in counts_by_path.iteritems():
+                counts_by_canonical_path.setdefault(self.canonicalize(path), []).append(count)
+            merged_counts[field] = {
+                canonical_path: path_counts[0] if len(path_counts) == 1
+                else combine(count or 0 for count in path_counts)
+                for canonical_path, path_counts in counts_by_canonical_path.iteritems()}
+        return merged_counts
+
+    def merged_variants(self):
+        """The canonical paths which variants were merged onto, with their variants."""
+        return {canonical_path: paths for canonical_path, paths in self.variants.iteritems()
+                if paths != [canonical_path]}
+
+    @staticmethod
+    def _decode_escape(match):
+        try:
+            character = ''.join(chr(int(escape, 16))
+                                for escape in match.group(0).split('%')[1:]).decode('utf-8')
+        except UnicodeDecodeError:
+            return PathCanonicalizer._upper_case_escape(match)
+        if character in RESERVED_ESCAPES:
+            return PathCanonicalizer._upper_case_escape(match)
+        return character if isinstance(match.string, unicode) else character.encode('utf-8')
+
+    @staticmethod
+    def _upper_case_escape(match):
+        return match.group(0).upper()
@@ -0,0 +1,105 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import urllib
+
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteResponse(object):
+    """The parts of a requests response which we use, as replayed from a cassette."""
+
+    def __init__(self, status_code, json_data):
+        self.status_code = status_code
+        self._json_data = json_data
+
+    def json(self):
+        return self._json_data
+
+
+class Cassette(object):
+    """
+    Record GET responses from the PP and the search API to a file, or replay them.
+
+    A cassette is a single gzipped JSON file per run, mapping a key for each
+    request (the dataset or URL plus its sorted query parameters) to the decoded
+    JSON response. It also holds the run's start and end dates, since the PP
+    requests are keyed by them, so that a replay can cover the same days as the
+    recording whenever it's made. In replay mode no network requests are made for the
+    recorded GETs; a request which isn't in the cassette raises a KeyError.
+    (GOVUK also records failed search API requests, and replays those and
+    missing ones as the failures which it logs; see GOVUK._get.)
+    """
+
+    RECORD = 'record'
+    REPLAY = 'replay'
+
+    date_format = '%Y-%m-%d'
+
+    def __init__(self, filename, mode):
+        if mode not in (self.RECORD, self.REPLAY):
+            raise ValueError('Cassette mode must be "record" or "replay", not {0!r}'.format(mode))
+
+        self.filename = filename
+        self.mode = mode
+        self.interactions = {}
+        self.start_date = None
+        self.end_date = None
+
+        if self.replaying:
+            self.load()
+
+    @property
+    def recording(self):
+        return self.mode == self.RECORD
+
+    @property
+    def replaying(self):
+        return self.mode == self.REPLAY
+
+    @staticmethod
+    def key(name, query_parameters=None):
+        if not query_parameters:
+            return name
+        return name + '?' + urllib.urlencode(sorted(query_parameters.items()))
+
+    def record(self, key, response):
+        self.interactions[key] = response
+
+    def replay(self, key):
+        try:
+            return self.interactions[key]
+        except KeyError:
+            raise KeyError('Request not recorded in cassette {0}: {1}'.format(self.filename, key))
+
+    def load(self):
+        with gzip.open(self.filename, 'rb') as cassette_file:
+            contents = json.load(cassette_file)
+        self.interactions = contents['interactions']
+        self.start_date = self._parse_date(contents['start_date'])
+        self.end_date = self._parse_date(contents['end_date'])
+        logger.info('Replaying %d requests from cassette: %s',
+                    len(self.interactions), self.filename)
+
+    def save(self):
+        logger.info('Writing %d requests to cassette: %s',
+                    len(self.interactions), self.filename)
+        contents = {
+            'start_date': self._format_date(self.start_date),
+            'end_date': self._format_date(self.end_date),
+            'interactions': self.interactions,
+        }
+        with gzip.open(self.filename, 'wb') as cassette_file:
+            json.dump(contents, cassette_file, separators=(',', ':'))
+
+    @classmethod
+    def _format_date(cls, date_or_datetime):
+        if date_or_datetime is not None:
+            return date_or_datetime.strftime(cls.date_format)
+
+    @classmethod
+    def _parse_date(cls, date_string):
+        if date_string is not None:
+            return datetime.strptime(date_string, cls.date_format).date()
@@ -12,21 +12,28 @@ class CSVWriter(object):
     """
     Write datapoints to a CSV file.
 
-    The filename can be passed in, or a date-based one will be used.
+    The filename can be passed in, or a date-based one will be used; likewise
+    for the file of merged path variants (see stats.canonical).
     """
-    def __init__(self, start_date=None, end_date=None, output_filename=None):
+    def __init__(self, start_date=None, end_date=None, output_filename=None,
+                 variants_filename=None):
         if output_filename is None and None in (start_date, end_date):
             raise ValueError('CSVWriter requires either output_filename or both start_date and end_date')
 
-        self.output_filename = output_filename or self._csv_filename(start_date, end_date)
+        self.output_filename = output_filename or self._csv_filename(
+            settings.REPORT_FILENAME, start_date, end_date)
+        self.variants_filename = variants_filename or self._csv_filename(
+            settings.PATH_VARIANTS_FILENAME, start_date, end_date)
 
     @staticmethod
     def _format_date(date_or_datetime):
         return date_or_datetime.strftime('%Y-%m-%d')
 
-    def _csv_filename(self, start_date, end_date):
-        return settings.REPORT_FILENAME.format(self._format_date(start_date),
-                                               self._format_date(end_date))
+    def _csv_filename(self, filename_format, start_date, end_date):
+        if None in (start_date, end_date):
+            return None
+        return filename_format.format(self._format_date(start_date),
+                                      self._format_date(end_date))
 
     def write_datapoints(self, datapoints):
         with open(self.output_filename, 'w') as report:
@@ -37,3 +44,14 @@ class CSVWriter(object):
 
             writer.writeheader()
             writer.writerows(dp.as_dict() for dp in datapoints)
+
+    def write_path_variants(self, variants):
+        """Write each of the variants of each canonical path, as {canonical path: [paths]}."""
+        with open(self.variants_filename, 'w') as variants_file:
+            writer = csv.writer(variants_file)
+
+            logger.info('Writing path variants to CSV file: %s', self.variants_filename)
+
+            writer.writerow(['canonicalPath', 'pagePath'])
+            for canonical_path, paths in sorted(variants.iteritems()):
+                writer.writerows([canonical_path, path] for path in paths)
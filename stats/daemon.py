@@ -0,0 +1,199 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime
+import json
+import logging
+import threading
+import time
+
+from .api import GOVUK
+from .info_statistics import InfoStatistics
+import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class StatsDaemon(object):
+    """
+    Run InfoStatistics repeatedly in a long-running process.
+
+    Between runs the daemon keeps:
+    - the search API connection pool and the list of smart answers, which is
+      refreshed after smart_answers_ttl seconds (and kept if a refresh fails)
+    - the pageview counts from the previous run, which are reused if the next
+      run covers the same dates; as runs end at midnight UTC, that's only for
+      runs on the same day, so an interval of a day or more never reuses them
+    - the aggregated datapoints from the latest successful run, which are
+      served with the run status over HTTP (see StatusRequestHandler)
+    - the PP latency trackers and circuit breakers, so that hedging and
+      failing fast carry on from one run to the next
+
+    Runs happen on the scheduler thread every interval seconds (measured from
+    the start of one run to the start of the next), so they never overlap; a
+    run which overruns is followed straight away by the next.
+
+    The Performance Platform client makes a new connection for each request, so
+    only the search API connections are pooled.
+    """
+
+    def __init__(self, pp_token, interval=None, smart_answers_ttl=None,
+                 dry_run=False, save_results=True):
+        import requests
+
+        self.pp_token = pp_token
+        self.interval = interval or settings.DAEMON_INTERVAL
+        self.smart_answers_ttl = smart_answers_ttl or settings.DAEMON_SMART_ANSWERS_TTL
+        self.dry_run = dry_run
+        self.save_results = save_results
+
+        self.govuk_adapter = GOVUK(session=requests.Session())
+        self.smart_answers = None
+        self.smart_answers_fetched_at = None
+        self.previous_run = None
+        self.latency_trackers = {}
+        self.circuit_breakers = {}
+
+        self.run_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.status = {
+            'state': 'idle',
+            'runs': 0,
+            'failures': 0,
+            'last_started': None,
+            'last_finished': None,
+            'last_error': None,
+            'next_run': None,
+        }
+        self.latest_datapoints = []
+
+    def run_once(self):
+        """
+        Refresh the statistics, unless a refresh is already running.
+
+        Returns whether a run happened.
+        """
+        if not self.run_lock.acquire(False):
+            logger.info('Skipping run: the previous run is still in progress')
+            return False
+
+        try:
+            self._update_status(state='running', last_started=self._now())
+            info = InfoStatistics(self.pp_token, dry_run=self.dry_run,
+                                  save_results=self.save_results,
+                                  govuk_adapter=self.govuk_adapter)
+            info.pp_adapter.latency_trackers = self.latency_trackers
+            info.pp_adapter.circuit_breakers = self.circuit_breakers
+            if self._covers_same_dates_as_previous_run(info):
+                info.previous_pageviews = self.previous_run.unique_pageviews
+            try:
+                info.process_data(smart_answers=self._get_smart_answers())
+            except Exception as e:
+                logger.exception('Run failed')
+                with self.state_lock:
+                    self.status['failures'] += 1
+                self._update_status(state='failed', last_error=str(e))
+            else:
+                self.previous_run = info
+                with self.state_lock:
+                    self.latest_datapoints = info.aggregated_datapoints
+                    self.status['runs'] += 1
+                self._update_status(state='idle', last_error=None)
+            finally:
+                self._update_status(last_finished=self._now())
+            return True
+        finally:
+            self.run_lock.release()
+
+    def serve_forever(self, host=None, port=None):
+        """Serve status and results over HTTP while running on the schedule."""
+        server = HTTPServer((host or settings.DAEMON_HOST, port or settings.DAEMON_PORT),
+                            StatusRequestHandler)
+        server.stats_daemon = self
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        logger.info('Serving status on http://%s:%d/', *server.server_address)
+
+        try:
+            self.run_scheduler()
+        finally:
+            server.shutdown()
+
+    def run_scheduler(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            self.run_once()
+
+            next_run = started + self.interval
+            self._update_status(next_run=self._format_timestamp(next_run))
+            self.stopped.wait(max(0, next_run - time.time()))
+
+    def stop(self):
+        self.stopped.set()
+
+    def get_status(self):
+        with self.state_lock:
+            return dict(self.status)
+
+    def get_latest_datapoints(self):
+        with self.state_lock:
+            return [datapoint.as_dict() for datapoint in self.latest_datapoints]
+
+    def _get_smart_answers(self):
+        now = time.time()
+        if (self.smart_answers is None or
+                now - self.smart_answers_fetched_at >= self.smart_answers_ttl):
+            smart_answers = self.govuk_adapter.get_smart_answers()
+            if smart_answers is not None:
+                self.smart_answers = smart_answers
+                self.smart_answers_fetched_at = now
+            elif self.smart_answers is not None:
+                logger.warning('Failed to refresh smart answers; using the previous list')
+        return self.smart_answers
+
+    def _covers_same_dates_as_previous_run(self, info):
+        # Compare the adapters' dates, as they're truncated to midnight
+        if self.previous_run is None:
+            return False
+        previous_adapter = self.previous_run.pp_adapter
+        return ((previous_adapter.start_date, previous_adapter.end_date) ==
+                (info.pp_adapter.start_date, info.pp_adapter.end_date))
+
+    def _update_status(self, **changes):
+        with self.state_lock:
+            self.status.update(changes)
+
+    def _now(self):
+        return self._format_timestamp(time.time())
+
+    @staticmethod
+    def _format_timestamp(timestamp):
+        return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve the daemon's status at /status and the latest results at /results,
+    as JSON.
+    """
+
+    def do_GET(self):
+        daemon = self.server.stats_daemon
+        if self.path == '/status':
+            self._send_json(daemon.get_status())
+        elif self.path == '/results':
+            self._send_json(daemon.get_latest_datapoints())
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data):
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
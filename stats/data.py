@@ -1,91 +1,268 @@
+from collections import OrderedDict
 import logging
+import sqlite3
+import tempfile
+
+from . import metrics
+from .estimation import PageviewEstimate
 
 
 logger = logging.getLogger(__name__)
 
 
 class Datapoint(object):
-    data_fields = ['uniquePageviews', 'problemReports', 'searchUniques', 'pagePath']
-    calculated_fields = ['_id', 'problemsPer100kViews', 'searchesPer100kViews']
-    all_fields = data_fields + calculated_fields
+    """
+    The counts for a page, with one field per registered metric (see
+    stats.metrics) and their rates per 100,000 pageviews.
+
+    The status fields say how the pageviews were got:
+    - pageviewsFetched is False if the run reached its deadline before fetching
+      the page's pageviews, in which case its rates are missing
+    - pageviewsEstimated is True if the page's pageviews were left unfetched
+      by long-tail sampling (see stats.estimation), in which case its
+      pageviews and rates are missing, and uniquePageviewsLower and
+      uniquePageviewsUpper are the range of pageviews of sampled pages like it
+
+    The ranges are only written to the CSV report: they're left out of
+    posted_fields, which are the fields POSTed to the PP.
+    """
+    data_fields = metrics.fields() + ['pagePath']
+    calculated_fields = ['_id'] + metrics.rate_fields()
+    status_fields = ['pageviewsFetched', 'pageviewsEstimated',
+                     'uniquePageviewsLower', 'uniquePageviewsUpper']
+    status_defaults = {
+        'pageviewsFetched': True,
+        'pageviewsEstimated': False,
+        'uniquePageviewsLower': None,
+        'uniquePageviewsUpper': None,
+    }
+    all_fields = data_fields + calculated_fields + status_fields
+    report_only_fields = ['uniquePageviewsLower', 'uniquePageviewsUpper']
+    posted_fields = [field for field in all_fields if field not in report_only_fields]
 
     def __init__(self, path):
         self.data = {field: 0 for field in self.data_fields}
         self.data['pagePath'] = path
+        self.data.update(self.status_defaults)
+
+    def set_pageviews_fetched(self, fetched):
+        self.data['pageviewsFetched'] = fetched
+
+    def get_pageviews_fetched(self):
+        return self.data['pageviewsFetched']
+
+    def set_pageview_estimate(self, estimate):
+        self.set_pageview_count(None)
+        self.data['pageviewsEstimated'] = True
+        self.data['uniquePageviewsLower'] = estimate.lower
+        self.data['uniquePageviewsUpper'] = estimate.upper
+
+    def is_pageview_estimate(self):
+        return self.data['pageviewsEstimated']
+
+    def get_pageview_interval(self):
+        """The range for estimated pageviews; just the pageviews otherwise."""
+        if self.is_pageview_estimate():
+            return self.data['uniquePageviewsLower'], self.data['uniquePageviewsUpper']
+        return self.get_pageview_count(), self.get_pageview_count()
+
+    def set_count(self, field, count):
+        self.data[field] = count
+
+    def get_count(self, field):
+        return self.data[field]
 
     def set_problem_reports_count(self, count):
-        self.data['problemReports'] = count
+        self.set_count(metrics.PROBLEM_REPORTS.field, count)
 
     def get_problem_reports_count(self):
-        return self.data['problemReports']
+        return self.get_count(metrics.PROBLEM_REPORTS.field)
 
     def set_search_count(self, count):
-        self.data['searchUniques'] = count
+        self.set_count(metrics.SEARCHES.field, count)
 
     def get_search_count(self):
-        return self.data['searchUniques']
+        return self.get_count(metrics.SEARCHES.field)
 
     def set_pageview_count(self, count):
-        self.data['uniquePageviews'] = count
+        self.set_count(metrics.PAGEVIEWS.field, count)
 
     def get_pageview_count(self):
-        return self.data['uniquePageviews']
+        return self.get_count(metrics.PAGEVIEWS.field)
 
     def get_path(self):
         return self.data['pagePath']
 
-    def as_dict(self):
-        return {key: self[key] for key in self.all_fields}
+    def as_dict(self, fields=None):
+        return {key: self[key] for key in fields or self.all_fields}
 
     def __getitem__(self, item):
-        if item == 'problemsPer100kViews':
-            return self._contact_rate()
-        elif item == 'searchesPer100kViews':
-            return self._search_rate()
-        elif item == '_id':
+        if item == '_id':
             return self.get_path().replace('/', '_').replace(' ', '%20')
+        elif item in self.calculated_fields:
+            metric = metrics.by_rate_field(item)
+            return metric.rate(self.get_count(metric.field), self.get_pageview_count())
         else:
             return self.data[item]
 
-    def _contact_rate(self):
-        if (self.data["uniquePageviews"]
-                and self.data["problemReports"]
-                and self.data["uniquePageviews"] > 0):
-            return float(self.data['problemReports'] * 100000) / self.data['uniquePageviews']
-
-    def _search_rate(self):
-        if (self.data["uniquePageviews"]
-                and self.data["searchUniques"]
-                and self.data["uniquePageviews"] > 0):
-            return float(self.data['searchUniques'] * 100000) / self.data['uniquePageviews']
-
 
 class AggregatedDataset(object):
 
     def __init__(self):
         self.entries = {}
 
+    def add_counts(self, field, counts):
+        for path, count in counts.iteritems():
+            self[path].set_count(field, count)
+
     def add_problem_report_counts(self, problem_reports):
-        for path, problem_report_count in problem_reports.iteritems():
-            self[path].set_problem_reports_count(problem_report_count)
+        self.add_counts(metrics.PROBLEM_REPORTS.field, problem_reports)
 
     def add_search_counts(self, search_counts):
-        for path, search_count in search_counts.iteritems():
-            self[path].set_search_count(search_count)
+        self.add_counts(metrics.SEARCHES.field, search_counts)
 
     def add_unique_pageviews(self, pageviews):
-        for path, pageview_count in pageviews.iteritems():
-            self[path].set_pageview_count(pageview_count)
+        self.add_counts(metrics.PAGEVIEWS.field, pageviews)
+
+    def add_pageview_estimates(self, estimates):
+        for path, estimate in estimates.iteritems():
+            self[path].set_pageview_estimate(estimate)
+
+    def mark_pageviews_not_fetched(self, paths):
+        for path in paths:
+            self[path].set_pageviews_fetched(False)
 
     def get_aggregated_datapoints(self):
         return self.entries
 
+    def iter_datapoints(self):
+        return self.entries.itervalues()
+
     def __getitem__(self, path):
         if path not in self.entries:
             self.entries[path] = Datapoint(path)
         return self.entries[path]
 
 
+class SpillingAggregatedDataset(AggregatedDataset):
+    """
+    An AggregatedDataset which holds at most max_entries datapoints in memory.
+
+    When the budget is exceeded, the in-memory datapoints are spilled to a
+    temporary SQLite database. A spilled datapoint which is added to again is
+    moved back into memory, so each path is either in memory or on disk.
+    iter_datapoints reads the spilled datapoints a row at a time, so that
+    they're never all in memory (get_aggregated_datapoints, which returns a
+    dict of them all, does load them).
+
+    The database is only committed once each add_* call is done, rather than
+    on every spill and move, and it's written without syncing or a journal,
+    since it's thrown away if the run fails anyway.
+    """
+
+    def __init__(self, max_entries):
+        super(SpillingAggregatedDataset, self).__init__()
+        self.max_entries = max_entries
+        self.spill_file = None
+        self.connection = None
+
+    def add_counts(self, field, counts):
+        super(SpillingAggregatedDataset, self).add_counts(field, counts)
+        self._commit()
+
+    def add_pageview_estimates(self, estimates):
+        super(SpillingAggregatedDataset, self).add_pageview_estimates(estimates)
+        self._commit()
+
+    def mark_pageviews_not_fetched(self, paths):
+        super(SpillingAggregatedDataset, self).mark_pageviews_not_fetched(paths)
+        self._commit()
+
+    def get_aggregated_datapoints(self):
+        datapoints = dict(self._spilled_datapoints())
+        datapoints.update(self.entries)
+        return datapoints
+
+    def iter_datapoints(self):
+        for datapoint in self.entries.itervalues():
+            yield datapoint
+        for _, datapoint in self._spilled_datapoints():
+            yield datapoint
+
+    def __getitem__(self, path):
+        if path not in self.entries:
+            datapoint = self._unspill(path) or Datapoint(path)
+            if len(self.entries) >= self.max_entries:
+                self._spill()
+            self.entries[path] = datapoint
+        return self.entries[path]
+
+    def _spill(self):
+        if self.connection is None:
+            self._open_spill_file()
+
+        logger.debug('Spilling %d datapoints to %s', len(self.entries), self.spill_file.name)
+        fields = self._stored_fields()
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO datapoints VALUES (?{0})'.format(', ?' * len(fields)),
+            ([sqlite3.Binary(path)] + [datapoint.get_count(field) for field in fields]
+             for path, datapoint in self.entries.iteritems()))
+        self.entries = {}
+
+    def _unspill(self, path):
+        if self.connection is None:
+            return None
+
+        key = sqlite3.Binary(path)
+        row = self.connection.execute(
+            'SELECT * FROM datapoints WHERE pagePath = ?', (key,)).fetchone()
+        if row is not None:
+            self.connection.execute('DELETE FROM datapoints WHERE pagePath = ?', (key,))
+            return self._datapoint_from_row(row)
+
+    def _commit(self):
+        if self.connection is not None:
+            self.connection.commit()
+
+    def _spilled_datapoints(self):
+        if self.connection is None:
+            return
+
+        # Read with a connection of our own, so that the datapoints can be
+        # read from another thread (such as the daemon's HTTP server)
+        connection = sqlite3.connect(self.spill_file.name)
+        try:
+            for row in connection.execute('SELECT * FROM datapoints'):
+                datapoint = self._datapoint_from_row(row)
+                yield datapoint.get_path(), datapoint
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _datapoint_from_row(row):
+        datapoint = Datapoint(str(row[0]))
+        for field, value in zip(SpillingAggregatedDataset._stored_fields(), row[1:]):
+            if isinstance(Datapoint.status_defaults.get(field), bool):
+                # SQLite stores booleans as integers
+                value = bool(value)
+            datapoint.set_count(field, value)
+        return datapoint
+
+    @staticmethod
+    def _stored_fields():
+        return metrics.fields() + Datapoint.status_fields
+
+    def _open_spill_file(self):
+        # The file is deleted when spill_file is closed or garbage collected
+        self.spill_file = tempfile.NamedTemporaryFile(prefix='stats-', suffix='.sqlite')
+        self.connection = sqlite3.connect(self.spill_file.name)
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute(
+            'CREATE TABLE datapoints (pagePath BLOB PRIMARY KEY, {0})'.format(
+                ', '.join(self._stored_fields())))
+
+
 class SmartAnswer(object):
 
     def __init__(self, path):
@@ -98,27 +275,41 @@ class SmartAnswer(object):
         return self.path != other.path
 
     def combine_datapoints(self, datapoints):
+        # Each metric says how it's combined: problem reports and searches are
+        # summed, and pageviews are the maximum of any of the pages
         combined_datapoint = Datapoint(self.path)
-
-        total_problem_reports_count = sum(datapoint.get_problem_reports_count()
-                                          for datapoint in datapoints)
-        total_search_count = sum(datapoint.get_search_count()
-                                 for datapoint in datapoints)
-        max_pageview_count = max(datapoint.get_pageview_count()
-                                 for datapoint in datapoints)
-
-        combined_datapoint.set_problem_reports_count(total_problem_reports_count)
-        combined_datapoint.set_search_count(total_search_count)
-        combined_datapoint.set_pageview_count(max_pageview_count)
+        for metric in metrics.METRICS:
+            combined_datapoint.set_count(metric.field, metric.combine(
+                datapoint.get_count(metric.field) for datapoint in datapoints))
+        combined_datapoint.set_pageviews_fetched(
+            all(datapoint.get_pageviews_fetched() for datapoint in datapoints))
+
+        # The combined pageviews are a maximum, so they're only known if no
+        # unfetched page could have more pageviews than the fetched ones
+        exact_pageviews = max([datapoint.get_pageview_count() for datapoint in datapoints
+                               if not datapoint.is_pageview_estimate()] or [None])
+        upper_bounds = [datapoint.get_pageview_interval()[1] for datapoint in datapoints
+                        if datapoint.is_pageview_estimate()]
+        if any(upper is None or upper > exact_pageviews for upper in upper_bounds):
+            intervals = [datapoint.get_pageview_interval() for datapoint in datapoints]
+            combined_datapoint.set_pageview_estimate(PageviewEstimate(
+                max(lower for lower, _ in intervals),
+                None if None in upper_bounds else max(upper for _, upper in intervals)))
         return combined_datapoint
 
 
 class AggregatedDatasetCombiningSmartAnswers(object):
 
-    def __init__(self, smartanswers):
-        self.underlying_dataset = AggregatedDataset()
+    def __init__(self, smartanswers, max_entries=None):
+        if max_entries is None:
+            self.underlying_dataset = AggregatedDataset()
+        else:
+            self.underlying_dataset = SpillingAggregatedDataset(max_entries)
         self.smartanswers = smartanswers
 
+    def add_counts(self, field, counts):
+        self.underlying_dataset.add_counts(field, counts)
+
     def add_problem_report_counts(self, problem_reports):
         self.underlying_dataset.add_problem_report_counts(problem_reports)
 
@@ -128,21 +319,50 @@ class AggregatedDatasetCombiningSmartAnswers(object):
     def add_unique_pageviews(self, pageviews):
         self.underlying_dataset.add_unique_pageviews(pageviews)
 
+    def add_pageview_estimates(self, estimates):
+        self.underlying_dataset.add_pageview_estimates(estimates)
+
+    def mark_pageviews_not_fetched(self, paths):
+        self.underlying_dataset.mark_pageviews_not_fetched(paths)
+
     def get_aggregated_datapoints(self):
+        return {datapoint.get_path(): datapoint
+                for datapoint in self.iter_aggregated_datapoints()}
+
+    def iter_aggregated_datapoints(self):
+        """
+        Yield the aggregated datapoints, with those for the pages of each
+        smart answer combined into one.
+
+        The underlying datapoints are read one at a time, and the pages of
+        each smart answer are combined as they're read, so only one combined
+        datapoint per smart answer is held in memory.
+        """
         logger.info('Aggregating datapoints')
-        datapoints = self.underlying_dataset.get_aggregated_datapoints()
+        combined_datapoints = OrderedDict()
+        for datapoint in self.underlying_dataset.iter_datapoints():
+            smartanswer = next((sa for sa in self.smartanswers
+                                if sa.includes(datapoint.get_path())), None)
+            if smartanswer is None:
+                yield datapoint
+                continue
 
-        for smartanswer in self.smartanswers:
-            datapoints_for_smartanswer = [dp for path, dp in datapoints.items()
-                                          if smartanswer.includes(path)]
-            if datapoints_for_smartanswer:
-                self._replace(datapoints, datapoints_for_smartanswer,
-                              smartanswer.combine_datapoints(datapoints_for_smartanswer))
+            combined_so_far = combined_datapoints.get(smartanswer.path)
+            combined_datapoints[smartanswer.path] = smartanswer.combine_datapoints(
+                [datapoint] if combined_so_far is None else [combined_so_far, datapoint])
 
-        return datapoints
+        for datapoint in combined_datapoints.itervalues():
+            yield datapoint
+
+
+class AggregatedDatapoints(object):
+    """
+    The aggregated datapoints of a dataset, aggregated afresh each time
+    they're iterated over, so that they needn't all be held in memory.
+    """
 
-    def _replace(self, all_datapoints, datapoints_to_remove, datapoint_to_add):
-        for datapoint in datapoints_to_remove:
-            all_datapoints.pop(datapoint.get_path(), None)
+    def __init__(self, dataset):
+        self.dataset = dataset
 
-        all_datapoints[datapoint_to_add.get_path()] = datapoint_to_add
+    def __iter__(self):
+        return self.dataset.iter_aggregated_datapoints()
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class EmptyPathIndex(object):
+    """
+    Remember the paths whose pageview lookups came back empty, to skip them.
+
+    Many paths with problem reports or searches (typos, query string variants,
+    removed pages) have no pageviews, and would otherwise be requested on every
+    run. Each path is kept with the time it was last found to be empty, and
+    expires after expiry_days. A random sample of recheck_rate of the unexpired
+    paths is fetched anyway on each run, so that paths which start getting
+    pageviews are noticed before they expire.
+
+    The index is a JSON file, which is only written by save().
+    """
+
+    def __init__(self, filename, expiry_days, recheck_rate, random_generator=None):
+        self.filename = filename
+        self.expiry_seconds = expiry_days * 24 * 60 * 60
+        self.recheck_rate = recheck_rate
+        self.random = random_generator or random.Random()
+        self.checked_at = {}
+
+        if os.path.exists(filename):
+            self.load()
+
+    def paths_to_skip(self, paths, now=None):
+        """The paths which are known to be empty, apart from the sample to recheck."""
+        now = now or time.time()
+        return set(path for path in paths
+                   if self._is_known_empty(path, now) and self.random.random() >= self.recheck_rate)
+
+    def update(self, pageviews, now=None):
+        """Record which of the fetched paths were empty, and forget the rest."""
+        now = now or time.time()
+        for path, pageview_count in pageviews.iteritems():
+            if pageview_count:
+                self.checked_at.pop(path, None)
+            else:
+                self.checked_at[path] = now
+
+    def load(self):
+        with open(self.filename, 'r') as index_file:
+            self.checked_at = {path.encode('utf-8'): checked_at
+                               for path, checked_at in json.load(index_file).iteritems()}
+        logger.info('Loaded %d known-empty paths from %s', len(self.checked_at), self.filename)
+
+    def save(self, now=None):
+        now = now or time.time()
+        self.checked_at = {path: checked_at for path, checked_at in self.checked_at.iteritems()
+                           if now - checked_at < self.expiry_seconds}
+
+        temporary_filename = self.filename + '.tmp'
+        with open(temporary_filename, 'w') as index_file:
+            json.dump(self.checked_at, index_file)
+        os.rename(temporary_filename, self.filename)
+
+    def _is_known_empty(self, path, now):
+        checked_at = self.checked_at.get(path)
+        return checked_at is not None and now - checked_at < self.expiry_seconds
@@ -0,0 +1,98 @@
+import logging
+import math
+import random
+
+
+logger = logging.getLogger(__name__)
+
+
+class PageviewEstimate(object):
+    """
+    The range of pageviews of a path which wasn't fetched: that of the sampled
+    paths with the same count, or None if none of them had it.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def __eq__(self, other):
+        return (self.lower, self.upper) == (other.lower, other.upper)
+
+    def __repr__(self):
+        return 'PageviewEstimate({0}, {1})'.format(self.lower, self.upper)
+
+
+class LongTailEstimator(object):
+    """
+    Fetch the pageviews of only a sample of the long-tail paths.
+
+    Paths whose count (problem reports plus searches) is above threshold are
+    fetched, as are paths under a smart answer, which are fetched together
+    anyway. Of the rest, a random sample of sample_rate of them is fetched,
+    and the others aren't. That's the trade-off: the sampled paths get exact
+    pageviews and rates, and stand in for the long tail as a whole, while the
+    others get neither.
+
+    A long-tail path's count is only 1 or 2, which says next to nothing about
+    its own pageviews, so no pageviews are made up for the paths which aren't
+    fetched. They're flagged as estimated (see Datapoint), with the range
+    covering `confidence` percent of the pageviews of the sampled paths with
+    the same count: the range such a page's pageviews are likely to be in, not
+    an estimate for the page itself.
+    """
+
+    def __init__(self, threshold, sample_rate, confidence=90, random_generator=None):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.confidence = confidence
+        self.random = random_generator or random.Random()
+
+    def split(self, paths, priorities, smart_answers=()):
+        """
+        Split the paths into those to fetch (the exact and sampled ones), the
+        sample, and those to estimate.
+        """
+        smart_answers = smart_answers or ()
+        long_tail = [path for path in paths
+                     if (priorities.get(path) or 0) <= self.threshold and
+                     not any(sa.includes(path) for sa in smart_answers)]
+        if not long_tail:
+            return list(paths), [], []
+
+        sample_size = min(len(long_tail), int(math.ceil(len(long_tail) * self.sample_rate)))
+        sample = set(self.random.sample(long_tail, sample_size))
+        to_estimate = set(long_tail) - sample
+
+        logger.info('Fetching pageviews for a sample of %d of %d long-tail paths',
+                    len(sample), len(long_tail))
+        return ([path for path in paths if path not in to_estimate],
+                [path for path in paths if path in sample],
+                [path for path in paths if path in to_estimate])
+
+    def estimate(self, paths, priorities, sampled_pageviews):
+        """
+        Get the range of pageviews for each of the paths from the sampled
+        paths with the same count, as {path: PageviewEstimate}.
+        """
+        sampled_by_count = {}
+        for path, pageviews in sampled_pageviews.iteritems():
+            sampled_by_count.setdefault(priorities.get(path) or 0, []).append(pageviews or 0)
+
+        sampled_count = sum(priorities.get(path) or 0 for path in sampled_pageviews)
+        sampled_views = sum(pageviews or 0 for pageviews in sampled_pageviews.itervalues())
+        if sampled_views:
+            logger.info('The sampled long-tail paths have %.1f problem reports and searches '
+                        'per 100k views', float(sampled_count * 100000) / sampled_views)
+
+        tail = (100 - self.confidence) / 2.0
+        ranges = {count: (self._percentile(sorted(pageviews), tail),
+                          self._percentile(sorted(pageviews), 100 - tail))
+                  for count, pageviews in sampled_by_count.iteritems()}
+        return {path: PageviewEstimate(*ranges.get(priorities.get(path) or 0, (None, None)))
+                for path in paths}
+
+    @staticmethod
+    def _percentile(ordered, percent):
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
@@ -1,9 +1,13 @@
 from datetime import datetime, timedelta
+import itertools
 import logging
+import time
 
 from .api import GOVUK, PerformancePlatform
 from .csv_writer import CSVWriter
-from .data import Datapoint, AggregatedDatasetCombiningSmartAnswers
+from .data import Datapoint, AggregatedDatapoints, AggregatedDatasetCombiningSmartAnswers
+from .planning import PageviewFetchPlan
+from .profiling import Profiler
 import settings
 
 
@@ -29,41 +33,185 @@ class InfoStatistics(object):
     - Write output to a local CSV file and to the PP
     """
 
-    def __init__(self, pp_token, start_date=None, end_date=None):
+    def __init__(self, pp_token, start_date=None, end_date=None,
+                 dry_run=False, save_results=True, cassette=None, profile_dir=None,
+                 govuk_adapter=None, previous_pageviews=None, deadline=None,
+                 empty_paths=None, estimator=None, canonicalizer=None):
         """
         Start and end dates are assumed to be UTC. They can be dates or datetimes.
+
+        With dry_run the results are logged rather than POSTed to the PP; with
+        save_results=False only the CSV report is written. A cassette records
+        or replays the GETs to the PP and the search API. With profile_dir,
+        each stage of the run is profiled (see stats.profiling).
+
+        previous_pageviews are pageview counts by path from an earlier run over
+        the same dates, which are used instead of fetching them again.
+
+        deadline is a number of seconds after the start of process_data by
+        which to stop fetching pageviews. Pageviews are fetched for the paths
+        with the most problem reports and searches first, and the datapoints
+        for any paths left unfetched are marked (see Datapoint).
+
+        empty_paths is an EmptyPathIndex of paths known to have no pageviews,
+        which are skipped; it's updated and saved after the pageviews are fetched.
+
+        estimator is a LongTailEstimator, to fetch the pageviews of only a
+        sample of the paths with few problem reports and searches and flag the
+        rest with a range of pageviews (see stats.estimation).
+
+        canonicalizer is a PathCanonicalizer, to merge the counts of the
+        variants of each path before fetching pageviews; the variants merged
+        are written to a CSV file alongside the report.
         """
         self.end_date = end_date or datetime.utcnow()
         self.start_date = start_date or (self.end_date - timedelta(days=settings.DAYS))
-        self.pp_adapter = PerformancePlatform(pp_token, self.start_date, self.end_date)
+        self.save_results = save_results
+        self.cassette = cassette
+        if cassette is not None and cassette.recording:
+            cassette.start_date = self.start_date
+            cassette.end_date = self.end_date
+        self.profiler = Profiler(profile_dir)
+        self.deadline = deadline
+        self.deadline_at = None
+        self.previous_pageviews = previous_pageviews or {}
+        self.empty_paths = empty_paths
+        self.estimator = estimator
+        self.canonicalizer = canonicalizer
+        self.unique_pageviews = {}
+        self.pageview_estimates = {}
+        self.aggregated_datapoints = []
+        self.govuk_adapter = govuk_adapter or GOVUK(cassette=cassette)
+        self.pp_adapter = PerformancePlatform(pp_token, self.start_date, self.end_date,
+                                              dry_run=dry_run, cassette=cassette)
         self.csv_writer = CSVWriter(start_date=self.start_date, end_date=self.end_date)
 
-    def process_data(self):
-        smart_answers = GOVUK().get_smart_answers()
-        dataset = self._load_performance_data(smart_answers)
-
-        aggregated_datapoints = dataset.get_aggregated_datapoints().values()
-
-        self.csv_writer.write_datapoints(aggregated_datapoints)
-        self.pp_adapter.save_aggregated_results(aggregated_datapoints)
+    def process_data(self, smart_answers=None):
+        """
+        Run the whole process, fetching the smart answers unless they're given.
+        """
+        if self.deadline is not None:
+            self.deadline_at = time.time() + self.deadline
+
+        try:
+            if smart_answers is None:
+                with self.profiler.stage('smart_answers'):
+                    smart_answers = self.govuk_adapter.get_smart_answers()
+            dataset = self._load_performance_data(smart_answers)
+
+            with self.profiler.stage('aggregation'):
+                if settings.AGGREGATION_MAX_ENTRIES is None:
+                    aggregated_datapoints = list(dataset.iter_aggregated_datapoints())
+                else:
+                    # Within a memory budget, the datapoints are aggregated
+                    # from the spill file each time they're written out
+                    aggregated_datapoints = AggregatedDatapoints(dataset)
+                self.aggregated_datapoints = aggregated_datapoints
+
+            with self.profiler.stage('csv'):
+                self.csv_writer.write_datapoints(aggregated_datapoints)
+                if self.canonicalizer is not None:
+                    self.csv_writer.write_path_variants(self.canonicalizer.merged_variants())
+            if self.save_results:
+                with self.profiler.stage('post'):
+                    self.pp_adapter.save_aggregated_results(aggregated_datapoints)
+        finally:
+            if self.cassette is not None and self.cassette.recording:
+                self.cassette.save()
+            self.profiler.write_summary()
 
     def _load_performance_data(self, smart_answers):
         logger.info('Loading performance data')
 
-        dataset = AggregatedDatasetCombiningSmartAnswers(smart_answers)
-        problem_report_counts = self.pp_adapter.get_problem_report_counts()
-        search_counts = self.pp_adapter.get_search_counts()
-        involved_paths = list(set(problem_report_counts.keys() + search_counts.keys()))
-        involved_paths.sort()
+        dataset = AggregatedDatasetCombiningSmartAnswers(
+            smart_answers, max_entries=settings.AGGREGATION_MAX_ENTRIES)
+        counts = self.pp_adapter.get_metric_counts(profiler=self.profiler)
+        if self.canonicalizer is not None:
+            counts = self._canonicalize(counts, smart_answers)
+        involved_paths = sorted(set(itertools.chain(*counts.values())))
 
         logger.info('Found %d paths to get pageview counts for', len(involved_paths))
         for path in involved_paths:
             logger.debug(path)
 
-        unique_pageviews = self.pp_adapter.get_unique_pageviews(involved_paths)
+        with self.profiler.stage('pageviews'):
+            unique_pageviews = self._get_unique_pageviews(involved_paths, smart_answers,
+                                                          self._priorities(counts))
 
-        dataset.add_unique_pageviews(unique_pageviews)
-        dataset.add_problem_report_counts(problem_report_counts)
-        dataset.add_search_counts(search_counts)
+        with self.profiler.stage('dataset'):
+            dataset.add_unique_pageviews(unique_pageviews)
+            dataset.add_pageview_estimates(self.pageview_estimates)
+            dataset.mark_pageviews_not_fetched(
+                path for path in involved_paths
+                if path not in unique_pageviews and path not in self.pageview_estimates)
+            for field, counts_by_path in counts.iteritems():
+                dataset.add_counts(field, counts_by_path)
 
         return dataset
+
+    def _canonicalize(self, counts, smart_answers):
+        paths = set(itertools.chain(*counts.values()))
+        counts = self.canonicalizer.merge_counts(counts)
+        canonical_paths = set(itertools.chain(*counts.values()))
+
+        for canonical_path, variants in sorted(self.canonicalizer.merged_variants().iteritems()):
+            logger.debug('Merged %s onto %s', ', '.join(variants), canonical_path)
+        requests_before = PageviewFetchPlan(paths, smart_answers).request_count
+        requests_after = PageviewFetchPlan(canonical_paths, smart_answers).request_count
+        logger.info('Merged %d paths onto %d canonical paths, avoiding %d requests',
+                    len(paths), len(canonical_paths), requests_before - requests_after)
+        return counts
+
+    @staticmethod
+    def _priorities(counts):
+        # A path's priority is the sum of its counts, e.g. problem reports plus searches
+        priorities = {}
+        for counts_by_path in counts.itervalues():
+            for path, count in counts_by_path.iteritems():
+                priorities[path] = priorities.get(path, 0) + (count or 0)
+        return priorities
+
+    def _get_unique_pageviews(self, paths, smart_answers, priorities=None):
+        paths_to_fetch = [path for path in paths if path not in self.previous_pageviews]
+        if len(paths_to_fetch) < len(paths):
+            logger.info('Reusing pageview counts for %d paths from the previous run',
+                        len(paths) - len(paths_to_fetch))
+
+        unique_pageviews = {path: self.previous_pageviews[path]
+                            for path in paths if path in self.previous_pageviews}
+
+        if self.empty_paths is not None:
+            empty_paths = self.empty_paths.paths_to_skip(paths_to_fetch)
+            unique_pageviews.update({path: None for path in empty_paths})
+            requests_before = PageviewFetchPlan(paths_to_fetch, smart_answers).request_count
+            paths_to_fetch = [path for path in paths_to_fetch if path not in empty_paths]
+            requests_after = PageviewFetchPlan(paths_to_fetch, smart_answers).request_count
+            logger.info('Skipping %d paths known to have no pageviews, avoiding %d requests',
+                        len(empty_paths), requests_before - requests_after)
+
+        if self.estimator is not None:
+            requests_before = PageviewFetchPlan(paths_to_fetch, smart_answers).request_count
+            paths_to_fetch, sample, paths_to_estimate = self.estimator.split(
+                paths_to_fetch, priorities or {}, smart_answers)
+            requests_after = PageviewFetchPlan(paths_to_fetch, smart_answers).request_count
+            logger.info('Estimating long-tail pageviews, avoiding %d requests',
+                        requests_before - requests_after)
+
+        fetched_pageviews = self.pp_adapter.get_unique_pageviews(
+            paths_to_fetch, smart_answers, priorities=priorities, deadline=self.deadline_at)
+        unique_pageviews.update(fetched_pageviews)
+
+        # Estimates are kept apart from the fetched pageviews, so that they're
+        # never reused as exact counts
+        if self.estimator is not None:
+            sampled_pageviews = {path: fetched_pageviews[path]
+                                 for path in sample if path in fetched_pageviews}
+            self.pageview_estimates = self.estimator.estimate(
+                paths_to_estimate, priorities or {}, sampled_pageviews)
+
+        if self.empty_paths is not None:
+            self.empty_paths.update(fetched_pageviews)
+            self.empty_paths.save()
+
+        self.unique_pageviews = unique_pageviews
+        return unique_pageviews
@@ -1,16 +1,215 @@
-import os
+"""
+Command line entry point.
+
+    python -m stats.main [run|dry-run|report-only|daemon|query]
+
+- run: fetch the data, write the CSV report and POST the results to the PP
+  (the default)
+- dry-run: as run, but log the POST instead of sending it
+- report-only: fetch the data and write the CSV report only
+- daemon: run on a schedule, serving the status and latest results over HTTP
+  (see stats.daemon); with --report-only, don't POST the results
+- query PATH [PATH ...]: print the totals and rates for each path and all the
+  pages under it, from a CSV report (today's by default; see stats.query)
+
+The one-off commands accept --record-cassette FILE, to save the GETs made to the
+PP and the search API, or --replay-cassette FILE, to serve them from a previous
+recording, for the same dates and without using the network (see
+stats.cassette), and --profile DIR to write per-stage CPU and allocation
+profiles to DIR (see stats.profiling; the PROFILE_DIR environment variable does
+the same). --deadline SECONDS stops fetching pageviews that many seconds into
+the run, fetching the most important pages first, and still writes the report.
+--empty-paths FILE (or the EMPTY_PATHS_FILENAME environment variable)
+remembers which paths had no pageviews, and skips them on later runs (see
+stats.empty_paths).
+--estimate-long-tail (or ESTIMATE_LONG_TAIL=1) fetches the pageviews of only a
+sample of the paths with few problem reports and searches, and flags the rest
+with a range of pageviews instead (see stats.estimation).
+--canonicalize-paths RULES (or CANONICALIZE_PATHS) merges the variants of each
+path, such as with and without a trailing slash, before fetching pageviews,
+and writes the variants merged to a CSV file (see stats.canonical).
+
+Only `run` and `daemon` (without --report-only) need PP_DATASET_TOKEN. The
+modules which talk to the PP and the search API are imported once the arguments
+and settings have been checked, so that a misconfigured invocation fails
+straight away.
+"""
+import argparse
 import sys
 
-from stats import info_statistics
 import settings
 
 
-if not settings.PP_TOKEN:
+def missing_token_message():
     msg = 'You need to set the dataset token for the PP '
     msg += '{0}/{1} '.format(settings.DATA_GROUP, settings.RESULTS_DATASET)
     msg += 'dataset to run this script. You can get this from '
     msg += 'https://stagecraft.production.performance.service.gov.uk/admin/'
-    sys.exit(msg)
-else:
-    c = info_statistics.InfoStatistics(settings.PP_TOKEN)
+    return msg
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='stats.main',
+        description='Load aggregate statistics into the PP info-statistics dataset.')
+    common = argparse.ArgumentParser(add_help=False)
+    cassette = common.add_mutually_exclusive_group()
+    cassette.add_argument('--record-cassette', metavar='FILE',
+                          help='record the GET responses to a cassette file')
+    cassette.add_argument('--replay-cassette', metavar='FILE',
+                          help='replay the GET responses from a cassette file')
+    common.add_argument('--profile', metavar='DIR', dest='profile_dir',
+                        help='write per-stage profiles to this directory')
+    common.add_argument('--deadline', type=float, metavar='SECONDS',
+                        help='stop fetching pageviews this many seconds into the run')
+    common.add_argument('--empty-paths', metavar='FILE',
+                        help='remember and skip paths with no pageviews, in this file')
+    common.add_argument('--estimate-long-tail', action='store_true',
+                        help='estimate the pageviews of long-tail paths from a sample')
+    common.add_argument('--canonicalize-paths', metavar='RULES',
+                        help="merge path variants by these comma-separated rules, or 'all'")
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('run', parents=[common],
+                          help='write the CSV report and POST the results')
+    subparsers.add_parser('dry-run', parents=[common],
+                          help='write the CSV report and log the POST')
+    subparsers.add_parser('report-only', parents=[common],
+                          help='only write the CSV report')
+
+    daemon = subparsers.add_parser('daemon', help='run on a schedule and serve the results')
+    daemon.add_argument('--interval', type=int, metavar='SECONDS',
+                        help='seconds between the starts of runs')
+    daemon.add_argument('--host', help='the address to serve the status and results on')
+    daemon.add_argument('--port', type=int, help='the port to serve the status and results on')
+    daemon.add_argument('--report-only', action='store_true',
+                        help='only write the CSV report on each run')
+
+    query = subparsers.add_parser('query', help='print totals and rates for sections of GOV.UK')
+    query.add_argument('paths', nargs='+', metavar='PATH',
+                       help='a path to total, with all the pages under it')
+    query.add_argument('--report', metavar='FILE',
+                       help='the CSV report to query (by default, the one for today)')
+    return parser
+
+
+def parse_args(argv):
+    # Keep `python -m stats.main` with no arguments doing a full run
+    return build_parser().parse_args(argv or ['run'])
+
+
+def build_cassette(args):
+    from stats.cassette import Cassette
+
+    if args.record_cassette:
+        return Cassette(args.record_cassette, Cassette.RECORD)
+    elif args.replay_cassette:
+        return Cassette(args.replay_cassette, Cassette.REPLAY)
+
+
+def needs_token(args):
+    if args.command == 'daemon':
+        return not args.report_only
+    return args.command == 'run'
+
+
+def run_daemon(args):
+    from stats.daemon import StatsDaemon
+
+    daemon = StatsDaemon(settings.PP_TOKEN, interval=args.interval,
+                         save_results=not args.report_only)
+    daemon.serve_forever(host=args.host, port=args.port)
+
+
+def run_query(args):
+    import csv
+    from datetime import datetime, timedelta
+
+    from stats import metrics
+    from stats.csv_writer import CSVWriter
+    from stats.query import PrefixIndex
+
+    report_filename = args.report
+    if report_filename is None:
+        end_date = datetime.utcnow()
+        start_date = end_date - timedelta(days=settings.DAYS)
+        report_filename = CSVWriter(start_date=start_date, end_date=end_date).output_filename
+
+    index = PrefixIndex.from_csv(report_filename)
+
+    fieldnames = ['pagePath', 'pages'] + metrics.fields() + metrics.rate_fields()
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    for path in args.paths:
+        row = index.subtree(path).as_dict()
+        row['pages'] = index.page_count(path)
+        writer.writerow(row)
+
+
+def build_empty_path_index(args):
+    from stats.empty_paths import EmptyPathIndex
+
+    filename = args.empty_paths or settings.EMPTY_PATHS_FILENAME
+    if filename:
+        return EmptyPathIndex(filename, settings.EMPTY_PATHS_EXPIRY_DAYS,
+                              settings.EMPTY_PATHS_RECHECK_RATE)
+
+
+def build_estimator(args):
+    from stats.estimation import LongTailEstimator
+
+    if args.estimate_long_tail or settings.ESTIMATE_LONG_TAIL:
+        return LongTailEstimator(settings.ESTIMATION_THRESHOLD,
+                                 settings.ESTIMATION_SAMPLE_RATE,
+                                 settings.ESTIMATION_CONFIDENCE)
+
+
+def build_canonicalizer(args):
+    from stats.canonical import PathCanonicalizer, parse_rules
+
+    rules = args.canonicalize_paths or settings.CANONICALIZE_PATHS
+    if rules:
+        return PathCanonicalizer(parse_rules(rules))
+
+
+def run_command(args):
+    from stats.info_statistics import InfoStatistics
+
+    cassette = build_cassette(args)
+    # A replay covers the same days as the recording, so that its requests match
+    replaying = cassette is not None and cassette.replaying
+    c = InfoStatistics(settings.PP_TOKEN,
+                       start_date=cassette.start_date if replaying else None,
+                       end_date=cassette.end_date if replaying else None,
+                       dry_run=(args.command == 'dry-run'),
+                       save_results=(args.command != 'report-only'),
+                       cassette=cassette,
+                       profile_dir=args.profile_dir or settings.PROFILE_DIR,
+                       deadline=args.deadline,
+                       empty_paths=build_empty_path_index(args),
+                       estimator=build_estimator(args),
+                       canonicalizer=build_canonicalizer(args))
     c.process_data()
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+
+    settings.load()
+
+    if needs_token(args) and not settings.PP_TOKEN:
+        return missing_token_message()
+
+    settings.configure_logging()
+    if args.command == 'daemon':
+        run_daemon(args)
+    elif args.command == 'query':
+        run_query(args)
+    else:
+        run_command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+The registry of metrics which make up each datapoint.
+
+Each metric names the PP dataset and the `collect` field it comes from, how it
+is fetched, how the values for the pages of a smart answer are combined, and
+optionally a derived rate per 100,000 pageviews. The Datapoint fields, the CSV
+columns and the queries made to the PP all come from METRICS, so adding a
+metric means adding an entry here.
+"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Fetch strategies
+BY_LETTER = 'by_letter'  # one query per starting letter, /a-/z, for all pages
+BY_PATH = 'by_path'      # one query per page (or smart answer; see PageviewFetchPlan)
+
+
+class Metric(object):
+
+    def __init__(self, field, dataset, collect, fetch, combine=sum, rate_field=None):
+        self.field = field
+        self.dataset = dataset
+        self.collect = collect
+        self.fetch = fetch
+        self.combine = combine
+        self.rate_field = rate_field
+
+    def rate(self, count, pageviews):
+        if pageviews and count and pageviews > 0:
+            return float(count * 100000) / pageviews
+
+    def __repr__(self):
+        return 'Metric({0!r})'.format(self.field)
+
+
+PAGEVIEWS = Metric('uniquePageviews', 'page-statistics', 'uniquePageviews:sum',
+                   fetch=BY_PATH, combine=max)
+PROBLEM_REPORTS = Metric('problemReports', 'page-contacts', 'total:sum',
+                         fetch=BY_LETTER, rate_field='problemsPer100kViews')
+SEARCHES = Metric('searchUniques', 'search-terms', 'searchUniques:sum',
+                  fetch=BY_LETTER, rate_field='searchesPer100kViews')
+
+METRICS = [PAGEVIEWS, PROBLEM_REPORTS, SEARCHES]
+
+
+def fields():
+    return [metric.field for metric in METRICS]
+
+
+def rate_fields():
+    return [metric.rate_field for metric in METRICS if metric.rate_field]
+
+
+def by_field(field):
+    return next(metric for metric in METRICS if metric.field == field)
+
+
+def by_rate_field(rate_field):
+    return next(metric for metric in METRICS if metric.rate_field == rate_field)
+
+
+def fetched_by_letter():
+    return [metric for metric in METRICS if metric.fetch == BY_LETTER]
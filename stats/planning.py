@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import logging
+import string
+
+
+logger = logging.getLogger(__name__)
+
+
+class PageviewFetchPlan(object):
+    """
+    Plan the page-statistics requests needed for the pageviews of some paths.
+
+    Paths which fall under a smart answer are fetched with a single query
+    filtered by the smart answer's path as a prefix, instead of one query per
+    sub-page. Only the pageviews of the planned paths are taken from that
+    query, so the results are the same as for per-path queries. A smart answer
+    with a single involved path is still fetched by path.
+
+    The fetches are ordered by priority, highest first: the sum of the given
+    priorities of their paths (with ties in path order), so that the most
+    important pages are fetched first if a run has to stop early.
+    """
+
+    def __init__(self, paths, smart_answers=(), priorities=None):
+        # Match the most specific smart answer first, in case one's path is a
+        # prefix of another's
+        smart_answers = sorted(smart_answers or (), key=lambda sa: len(sa.path), reverse=True)
+
+        paths_by_prefix = {}
+        self.single_paths = []
+        for path in paths:
+            smart_answer = next((sa for sa in smart_answers if sa.includes(path)), None)
+            if smart_answer is None:
+                self.single_paths.append(path)
+            else:
+                paths_by_prefix.setdefault(smart_answer.path, []).append(path)
+
+        self.prefix_groups = {}
+        for prefix, prefixed_paths in paths_by_prefix.iteritems():
+            if len(prefixed_paths) > 1:
+                self.prefix_groups[prefix] = prefixed_paths
+            else:
+                self.single_paths.extend(prefixed_paths)
+        self.single_paths.sort()
+
+        self.path_count = len(paths)
+
+        # Each fetch is (prefix, paths), with a prefix of None for a single path
+        priorities = priorities or {}
+        fetches = ([(prefix, prefixed_paths)
+                    for prefix, prefixed_paths in sorted(self.prefix_groups.iteritems())] +
+                   [(None, [path]) for path in self.single_paths])
+
+        def priority_order(fetch):
+            prefix, fetch_paths = fetch
+            priority = sum(priorities.get(path) or 0 for path in fetch_paths)
+            return -priority, prefix or fetch_paths[0]
+
+        self.fetches = sorted(fetches, key=priority_order)
+
+    @property
+    def request_count(self):
+        return len(self.prefix_groups) + len(self.single_paths)
+
+
+class MetricFetchPlan(object):
+    """
+    Plan one fan-out of queries for all of the metrics fetched by letter.
+
+    Metrics from the same dataset share their queries, each of which collects
+    all of their fields, so each dataset is queried once per starting letter
+    however many metrics come from it.
+    """
+
+    def __init__(self, metrics, prefixes=None):
+        self.prefixes = prefixes or ['/' + letter for letter in string.lowercase]
+
+        self.metrics_by_dataset = OrderedDict()
+        for metric in metrics:
+            self.metrics_by_dataset.setdefault(metric.dataset, []).append(metric)
+
+    def queries(self):
+        """Yield (dataset, metrics, path prefix) for each query to make."""
+        for dataset, metrics in self.metrics_by_dataset.iteritems():
+            for prefix in self.prefixes:
+                yield dataset, metrics, prefix
+
+    @property
+    def request_count(self):
+        return len(self.metrics_by_dataset) * len(self.prefixes)
@@ -0,0 +1,101 @@
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import gc
+import logging
+import os
+import resource
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_FILENAME = 'allocations.txt'
+TOP_ALLOCATIONS = 10
+
+
+def _count_objects_by_type():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StageProfile(object):
+
+    def __init__(self, name, seconds, max_rss_growth_kb, object_growth):
+        self.name = name
+        self.seconds = seconds
+        self.max_rss_growth_kb = max_rss_growth_kb
+        self.object_growth = object_growth
+
+    def top_allocations(self, count=TOP_ALLOCATIONS):
+        return [(type_name, growth) for type_name, growth in self.object_growth.most_common(count)
+                if growth > 0]
+
+
+class Profiler(object):
+    """
+    Profile the stages of a run, if given a directory to write the results to.
+
+    Each stage is run under cProfile, and its stats are dumped to
+    `<stage>.prof` (readable with pstats or snakeviz). Allocations are traced by
+    the growth in the number of gc-tracked objects of each type during the
+    stage, along with the growth in peak RSS; a summary of these is written to
+    `allocations.txt`.
+
+    Without an output directory, stages run unprofiled with no overhead.
+    """
+
+    def __init__(self, output_dir=None):
+        self.output_dir = output_dir
+        self.stage_profiles = []
+
+        if self.enabled and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    @property
+    def enabled(self):
+        return self.output_dir is not None
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        objects_before = _count_objects_by_type()
+        max_rss_before = _max_rss_kb()
+        started = time.time()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            seconds = time.time() - started
+
+            object_growth = _count_objects_by_type()
+            object_growth.subtract(objects_before)
+            self.stage_profiles.append(
+                StageProfile(name, seconds, _max_rss_kb() - max_rss_before, object_growth))
+
+            profile_filename = os.path.join(self.output_dir, name + '.prof')
+            profile.dump_stats(profile_filename)
+            logger.info('Profiled stage %s in %.2fs: %s', name, seconds, profile_filename)
+
+    def write_summary(self):
+        if not self.enabled:
+            return
+
+        summary_filename = os.path.join(self.output_dir, SUMMARY_FILENAME)
+        logger.info('Writing profiling summary to %s', summary_filename)
+
+        with open(summary_filename, 'w') as summary:
+            for stage_profile in self.stage_profiles:
+                summary.write('{0}: {1:.2f}s, peak RSS +{2}KB\n'.format(
+                    stage_profile.name, stage_profile.seconds, stage_profile.max_rss_growth_kb))
+                for type_name, growth in stage_profile.top_allocations():
+                    summary.write('    {0:>10} {1}\n'.format('+' + str(growth), type_name))
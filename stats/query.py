@@ -0,0 +1,130 @@
+from bisect import bisect_left
+import csv
+import logging
+
+from . import metrics
+from .data import Datapoint
+from .estimation import PageviewEstimate
+
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex(object):
+    """
+    Answer questions about whole sections of GOV.UK from aggregated datapoints.
+
+    The paths are sorted, with cumulative sums of each metric's counts (the
+    pageviews, problem reports and searches), so that the totals for all the pages in a subtree
+    (a path and everything under it, e.g. `/browse/benefits` and
+    `/browse/benefits/tax-credits`) take a few binary searches.
+
+    The rates for a subtree are only of the pages which have pageviews, so
+    there are also cumulative sums of the counts of those pages alone (see
+    SubtreeTotals). Estimated pageviews (see stats.estimation) aren't counted
+    as pageviews, as they're derived from the other counts.
+    """
+
+    def __init__(self, datapoints):
+        datapoints = sorted(datapoints, key=lambda dp: dp.get_path())
+        self.paths = [datapoint.get_path() for datapoint in datapoints]
+
+        has_pageviews = [bool(datapoint.get_pageview_count()) and
+                         not datapoint.is_pageview_estimate() for datapoint in datapoints]
+        self.cumulative_counts = {
+            field: self._cumulative_sums(datapoint.get_count(field) for datapoint in datapoints)
+            for field in metrics.fields()
+        }
+        self.cumulative_counts[metrics.PAGEVIEWS.field] = self._cumulative_sums(
+            datapoint.get_pageview_count() if rated else 0
+            for datapoint, rated in zip(datapoints, has_pageviews))
+        self.cumulative_rated_counts = {
+            field: self._cumulative_sums(datapoint.get_count(field) if rated else 0
+                                         for datapoint, rated in zip(datapoints, has_pageviews))
+            for field in metrics.fields()
+        }
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Build an index from a CSV report written by CSVWriter."""
+        logger.debug('Reading report from CSV file: %s', filename)
+        with open(filename, 'r') as report:
+            return cls(cls._datapoint_from_row(row) for row in csv.DictReader(report))
+
+    def subtree(self, path):
+        """
+        Get a datapoint with the totals and rates for the path and all the
+        paths under it.
+        """
+        ranges = self._subtree_ranges(path)
+
+        datapoint = SubtreeTotals(path)
+        for field, cumulative_sums in self.cumulative_counts.iteritems():
+            datapoint.set_count(field, self._total(cumulative_sums, ranges))
+        for field, cumulative_sums in self.cumulative_rated_counts.iteritems():
+            datapoint.rated_counts[field] = self._total(cumulative_sums, ranges)
+        return datapoint
+
+    def page_count(self, path):
+        return sum(end - start for start, end in self._subtree_ranges(path))
+
+    def _subtree_ranges(self, path):
+        path = path.rstrip('/')
+        if not path:
+            return [(0, len(self.paths))]
+
+        # The paths under the path sort from path + '/' to path + '0' ('0'
+        # follows '/' in ASCII). The path itself isn't next to them when there
+        # are siblings like path + '-2', so it has its own range.
+        ranges = [(bisect_left(self.paths, path + '/'), bisect_left(self.paths, path + '0'))]
+        own_index = bisect_left(self.paths, path)
+        if own_index < len(self.paths) and self.paths[own_index] == path:
+            ranges.append((own_index, own_index + 1))
+        return ranges
+
+    @staticmethod
+    def _datapoint_from_row(row):
+        def count(value):
+            if value:
+                return float(value) if '.' in value else int(value)
+
+        datapoint = Datapoint(row['pagePath'])
+        for field in metrics.fields():
+            datapoint.set_count(field, count(row[field]))
+        # Reports from before estimation have no pageviewsEstimated column
+        if row.get('pageviewsEstimated') == 'True':
+            datapoint.set_pageview_estimate(PageviewEstimate(
+                count(row['uniquePageviewsLower']), count(row['uniquePageviewsUpper'])))
+        return datapoint
+
+    @staticmethod
+    def _cumulative_sums(counts):
+        sums = [0]
+        for count in counts:
+            sums.append(sums[-1] + (count or 0))
+        return sums
+
+    @staticmethod
+    def _total(cumulative_sums, ranges):
+        return sum(cumulative_sums[end] - cumulative_sums[start] for start, end in ranges)
+
+
+class SubtreeTotals(Datapoint):
+    """
+    The totals for a subtree (see PrefixIndex.subtree).
+
+    The counts are for all of its pages, but its rates are of the counts of
+    the pages with pageviews, in rated_counts: a page without pageviews has
+    nothing to divide its problem reports and searches by, so counting them
+    would inflate the rates.
+    """
+
+    def __init__(self, path):
+        super(SubtreeTotals, self).__init__(path)
+        self.rated_counts = {}
+
+    def __getitem__(self, item):
+        if item in metrics.rate_fields():
+            metric = metrics.by_rate_field(item)
+            return metric.rate(self.rated_counts.get(metric.field), self.get_pageview_count())
+        return super(SubtreeTotals, self).__getitem__(item)
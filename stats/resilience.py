@@ -0,0 +1,140 @@
+from collections import deque
+import logging
+import Queue
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request while a dataset's circuit is open."""
+
+    def __init__(self, dataset_name, retry_in):
+        super(CircuitOpenError, self).__init__(
+            'Circuit open for {0}: too many failed requests; retry in {1:.0f}s'.format(
+                dataset_name, retry_in))
+        self.dataset_name = dataset_name
+        self.retry_in = retry_in
+
+
+class LatencyTracker(object):
+    """Keep the latencies of recent requests, to find a high percentile."""
+
+    def __init__(self, window=1000):
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100.0))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self.latencies)
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast for a dataset once too many of its recent requests have failed.
+
+    The circuit opens when at least min_requests of the last `window` requests
+    have been made and the proportion which failed is at least error_rate.
+    While it's open, requests raise CircuitOpenError; after reset_seconds one
+    trial request is let through, and the circuit closes again if it succeeds.
+    """
+
+    def __init__(self, dataset_name, error_rate, min_requests, reset_seconds, window=20):
+        self.dataset_name = dataset_name
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.reset_seconds = reset_seconds
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def seconds_until_retry(self):
+        if not self.is_open:
+            return 0
+        return max(0, self.opened_at + self.reset_seconds - time.time())
+
+    def before_request(self):
+        with self.lock:
+            retry_in = self.seconds_until_retry()
+            if self.is_open and retry_in > 0:
+                raise CircuitOpenError(self.dataset_name, retry_in)
+
+    def record_success(self):
+        with self.lock:
+            self.outcomes.append(True)
+            if self.is_open:
+                logger.info('Closing circuit for %s', self.dataset_name)
+                self.opened_at = None
+                self.outcomes.clear()
+
+    def record_failure(self):
+        with self.lock:
+            self.outcomes.append(False)
+            failures = self.outcomes.count(False)
+            if self.is_open:
+                # A failed trial request keeps the circuit open for another period
+                self.opened_at = time.time()
+            elif (len(self.outcomes) >= self.min_requests and
+                    float(failures) / len(self.outcomes) >= self.error_rate):
+                logger.warning('Opening circuit for %s: %d of the last %d requests failed',
+                               self.dataset_name, failures, len(self.outcomes))
+                self.opened_at = time.time()
+
+
+def hedged_call(func, hedge_after):
+    """
+    Call func, calling it again in parallel if it hasn't returned after
+    hedge_after seconds, and return whichever result comes first.
+
+    If hedge_after is None, func is just called. An exception is only raised if
+    every call fails (the first call's exception, if both do).
+    """
+    if hedge_after is None:
+        return func()
+
+    results = Queue.Queue()
+
+    def attempt():
+        try:
+            results.put((True, func()))
+        except Exception:
+            results.put((False, sys.exc_info()))
+
+    def start_attempt():
+        thread = threading.Thread(target=attempt)
+        thread.daemon = True
+        thread.start()
+
+    start_attempt()
+    attempts = 1
+    try:
+        succeeded, value = results.get(timeout=hedge_after)
+    except Queue.Empty:
+        logger.debug('Hedging a request which took longer than %.2fs', hedge_after)
+        start_attempt()
+        attempts = 2
+        succeeded, value = results.get()
+
+    if not succeeded and attempts == 2:
+        other_succeeded, other_value = results.get()
+        if other_succeeded:
+            succeeded, value = other_succeeded, other_value
+
+    if succeeded:
+        return value
+    raise value[0], value[1], value[2]
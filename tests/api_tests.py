@@ -8,8 +8,11 @@ import urllib
 
 import responses
 
+from .helpers import TemporaryDirectory
 from stats.api import GOVUK, PerformancePlatform
 from stats.data import SmartAnswer
+from stats.metrics import BY_LETTER, Metric, SEARCHES
+from stats.profiling import Profiler
 
 
 # Prevent info/debug logging cluttering up test output
@@ -191,3 +194,115 @@ class TestPerformancePlatform(unittest.TestCase):
         }
         self.assertEqual(pp.get_unique_pageviews(expected_pageview_counts.keys()),
                          expected_pageview_counts)
+
+    @responses.activate
+    def test_unique_pageview_fetching_groups_smart_answer_pages(self):
+        page_statistics = """
+        {
+          "data": [
+            {
+              "pagePath": "/am-i-getting-minimum-wag€",
+              "uniquePageviews:sum": 2000.0
+            },
+            {
+              "pagePath": "/am-i-getting-minimum-wag€/y",
+              "uniquePageviews:sum": 500.0
+            },
+            {
+              "pagePath": "/am-i-getting-minimum-wag€/n",
+              "uniquePageviews:sum": 300.0
+            }
+          ]
+        }
+        """
+
+        url_re = re.compile(
+            r'https://www.performance.service.gov.uk/data/govuk-info/page-statistics.*?filter_by_prefix=' + urllib.quote("pagePath:/am-i-getting-minimum-wag€", "")
+        )
+        responses.add(responses.GET, url_re,
+                      body=page_statistics, status=200,
+                      content_type='application/json')
+
+        pp = PerformancePlatform('foo',
+                                 start_date=date(2014, 12, 16),
+                                 end_date=date(2015, 01, 27))
+
+        expected_pageview_counts = {
+            "/am-i-getting-minimum-wag€": 2000,
+            "/am-i-getting-minimum-wag€/y": 500,
+            "/am-i-getting-minimum-wag€/y/n": None,
+        }
+        pageviews = pp.get_unique_pageviews(expected_pageview_counts.keys(),
+                                            [SmartAnswer("/am-i-getting-minimum-wag€")])
+        self.assertEqual(pageviews, expected_pageview_counts)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_metrics_from_the_same_dataset_are_fetched_together(self):
+        searches = """
+        {
+          "data": [
+            {
+              "pagePath": "/academi€s-financial-returns",
+              "searchUniques:sum": 10.0,
+              "searchRefinements:sum": 4.0
+            }
+          ]
+        }
+        """
+
+        url_re = re.compile(
+            r'https://www.performance.service.gov.uk/data/govuk-info/search-terms.*?filter_by_prefix=pagePath%3A%2Fa'
+        ) # pagePath:/a
+        responses.add(responses.GET, url_re,
+                      body=searches, status=200,
+                      content_type='application/json')
+
+        url_re = re.compile(
+            r'https://www.performance.service.gov.uk/data/govuk-info/search-terms.*?'
+        )
+        responses.add(responses.GET, url_re,
+                      body='[]', status=200,
+                      content_type='application/json')
+
+        pp = PerformancePlatform('foo',
+                                 start_date=date(2014, 12, 16),
+                                 end_date=date(2015, 01, 27))
+        refinements = Metric('searchRefinements', 'search-terms', 'searchRefinements:sum',
+                             fetch=BY_LETTER)
+
+        counts = pp.get_metric_counts([SEARCHES, refinements])
+
+        self.assertEqual(counts, {
+            'searchUniques': {"/academi€s-financial-returns": 10},
+            'searchRefinements': {"/academi€s-financial-returns": 4},
+        })
+        self.assertEqual(len(responses.calls), 26)
+        self.assertIn('collect=searchUniques%3Asum', responses.calls[0].request.url)
+        self.assertIn('collect=searchRefinements%3Asum', responses.calls[0].request.url)
+
+    @responses.activate
+    def test_each_datasets_counts_are_profiled_as_a_stage(self):
+        url_re = re.compile(r'https://www.performance.service.gov.uk/data/govuk-info/.*?')
+        responses.add(responses.GET, url_re,
+                      body='{"data": []}', status=200,
+                      content_type='application/json')
+
+        pp = PerformancePlatform('foo',
+                                 start_date=date(2014, 12, 16),
+                                 end_date=date(2015, 01, 27))
+        with TemporaryDirectory() as tempdir:
+            profiler = Profiler(tempdir)
+            pp.get_metric_counts(profiler=profiler)
+
+        self.assertEqual([stage.name for stage in profiler.stage_profiles],
+                         ['counts_page_contacts', 'counts_search_terms'])
+
+    @responses.activate
+    def test_unique_pageview_fetching_stops_at_the_deadline(self):
+        pp = PerformancePlatform('foo',
+                                 start_date=date(2014, 12, 16),
+                                 end_date=date(2015, 01, 27))
+
+        self.assertEqual(pp.get_unique_pageviews(['/a', '/b'], deadline=0), {})
+        self.assertEqual(len(responses.calls), 0)
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+from datetime import date
+import json
+import logging
+import unittest
+
+from mock import Mock, mock_open, patch
+
+from stats.canonical import parse_rules, PathCanonicalizer, RULES
+from stats.info_statistics import InfoStatistics
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestPathCanonicalizer(unittest.TestCase):
+
+    def test_all_rules(self):
+        canonicalizer = PathCanonicalizer()
+
+        self.assertEqual(canonicalizer.canonicalize('/Browse/Benefits/?foo=bar#top'),
+                         '/browse/benefits')
+        self.assertEqual(canonicalizer.canonicalize('/vat%2drates'), '/vat-rates')
+        self.assertEqual(canonicalizer.canonicalize('/a%2fb'), '/a%2Fb')
+        self.assertEqual(canonicalizer.canonicalize('/caf%C3%A9'), '/café')
+        self.assertEqual(canonicalizer.canonicalize('/'), '/')
+
+    def test_escapes_which_arent_utf8_are_left_encoded(self):
+        canonicalizer = PathCanonicalizer()
+
+        self.assertEqual(canonicalizer.canonicalize('/caf%e9'), '/caf%E9')
+        self.assertEqual(canonicalizer.canonicalize('/caf%e9%2d%C3%A9%c3'), '/caf%E9-\xc3\xa9%C3')
+        self.assertEqual(canonicalizer.canonicalize(u'/caf%C3%A9%2F'), u'/caf\xe9%2F')
+        json.dumps([canonicalizer.canonicalize('/caf%E9'), canonicalizer.canonicalize('/caf%C3%A9')])
+
+    def test_only_the_given_rules_are_applied(self):
+        canonicalizer = PathCanonicalizer(['trailing_slash'])
+
+        self.assertEqual(canonicalizer.canonicalize('/Browse/?foo=bar'), '/Browse/?foo=bar')
+        self.assertEqual(canonicalizer.canonicalize('/Browse/'), '/Browse')
+
+    def test_unknown_rules_are_rejected(self):
+        self.assertRaises(ValueError, PathCanonicalizer, ['trailing_slash', 'www'])
+
+    def test_parse_rules(self):
+        self.assertEqual(parse_rules('all'), RULES)
+        self.assertEqual(parse_rules('case, trailing_slash'), ['case', 'trailing_slash'])
+
+    def test_variant_counts_are_merged(self):
+        canonicalizer = PathCanonicalizer()
+
+        merged = canonicalizer.merge_counts({
+            'problemReports': {'/vat': 2, '/vat/': 1, '/VAT?x=1': 3, '/other': None},
+            'searchUniques': {'/vat#rates': 5},
+        })
+
+        self.assertEqual(merged, {
+            'problemReports': {'/vat': 6, '/other': None},
+            'searchUniques': {'/vat': 5},
+        })
+        self.assertEqual(canonicalizer.merged_variants(),
+                         {'/vat': ['/VAT?x=1', '/vat', '/vat#rates', '/vat/']})
+
+
+class TestInfoStatisticsCanonicalization(unittest.TestCase):
+
+    @patch('stats.csv_writer.CSVWriter.write_path_variants')
+    @patch('__builtin__.open', new=mock_open())
+    def test_pageviews_are_fetched_for_canonical_paths(self, write_path_variants):
+        info = InfoStatistics('foo',
+                              start_date=date(2014, 12, 16),
+                              end_date=date(2015, 01, 27),
+                              canonicalizer=PathCanonicalizer())
+        info.pp_adapter = Mock()
+        info.pp_adapter.get_metric_counts.return_value = {
+            'problemReports': {'/vat': 2, '/vat/': 1},
+            'searchUniques': {'/vat?q=rates': 4, '/tax': 1},
+        }
+        info.pp_adapter.get_unique_pageviews.return_value = {'/tax': 1000, '/vat': 2000}
+
+        info.process_data(smart_answers=[])
+
+        self.assertEqual(info.pp_adapter.get_unique_pageviews.call_args[0][0], ['/tax', '/vat'])
+        datapoints = {dp.get_path(): dp for dp in info.aggregated_datapoints}
+        self.assertEqual(datapoints['/vat'].get_problem_reports_count(), 3)
+        self.assertEqual(datapoints['/vat'].get_search_count(), 4)
+        write_path_variants.assert_called_once_with(
+            {'/vat': ['/vat', '/vat/', '/vat?q=rates']})
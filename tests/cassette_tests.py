@@ -0,0 +1,130 @@
+# coding=utf-8
+
+from datetime import date, datetime
+import logging
+import os
+import re
+import unittest
+
+import responses
+
+from .helpers import TemporaryDirectory
+from stats.api import GOVUK, PerformancePlatform
+from stats.cassette import Cassette
+from stats.data import SmartAnswer
+from stats.info_statistics import InfoStatistics
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestCassette(unittest.TestCase):
+
+    def test_key_sorts_query_parameters(self):
+        self.assertEqual(Cassette.key('page-statistics', {'b': '2', 'a': '1'}),
+                         'page-statistics?a=1&b=2')
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, Cassette, 'cassette.json.gz', 'rewind')
+
+    @responses.activate
+    def test_pageviews_and_smart_answers_are_replayed_without_network(self):
+        page_statistics = """
+        {
+          "data": [
+            {
+              "pagePath": "/am-i-getting-minimum-wag€",
+              "uniquePageviews:sum": 2000.0
+            }
+          ]
+        }
+        """
+        smart_answers = """
+        {
+          "results": [
+            {
+              "link": "/am-i-getting-minimum-wag€"
+            }
+          ]
+        }
+        """
+
+        url_re = re.compile(
+            r'https://www.performance.service.gov.uk/data/govuk-info/page-statistics.*?'
+        )
+        responses.add(responses.GET, url_re,
+                      body=page_statistics, status=200,
+                      content_type='application/json')
+        url_re = re.compile(r'https://www.gov.uk/api/search.json.*?')
+        responses.add(responses.GET, url_re,
+                      body=smart_answers, status=200,
+                      content_type='application/json')
+
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'cassette.json.gz')
+
+            cassette = Cassette(filename, Cassette.RECORD)
+            self._fetch(cassette)
+            cassette.save()
+            self.assertEqual(len(responses.calls), 2)
+
+            # With nothing registered, any real request would fail
+            responses.reset()
+            pageviews, answers = self._fetch(Cassette(filename, Cassette.REPLAY))
+            self.assertEqual(len(responses.calls), 0)
+
+        self.assertEqual(pageviews, {"/am-i-getting-minimum-wag€": 2000})
+        self.assertEqual(answers, [SmartAnswer("/am-i-getting-minimum-wag€")])
+
+    def test_the_runs_dates_are_replayed(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'cassette.json.gz')
+            cassette = Cassette(filename, Cassette.RECORD)
+            InfoStatistics('foo', end_date=datetime(2015, 01, 27, 12, 30), cassette=cassette)
+            cassette.save()
+
+            cassette = Cassette(filename, Cassette.REPLAY)
+        self.assertEqual((cassette.start_date, cassette.end_date),
+                         (date(2014, 12, 16), date(2015, 01, 27)))
+
+    def test_unrecorded_request_raises_key_error(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'cassette.json.gz')
+            Cassette(filename, Cassette.RECORD).save()
+
+            pp = self._pp(Cassette(filename, Cassette.REPLAY))
+            self.assertRaises(KeyError, pp.get_unique_pageviews_for_path, '/missing')
+
+    @responses.activate
+    def test_failed_search_request_is_replayed_as_a_failure(self):
+        # With nothing registered, the request fails with a ConnectionError
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'cassette.json.gz')
+
+            cassette = Cassette(filename, Cassette.RECORD)
+            self.assertEqual(GOVUK(cassette=cassette).get_smart_answers(), None)
+            cassette.save()
+
+            cassette = Cassette(filename, Cassette.REPLAY)
+            self.assertEqual(GOVUK(cassette=cassette).get_smart_answers(), None)
+        self.assertEqual(len(responses.calls), 1)
+
+    def test_unrecorded_search_request_is_logged_as_a_failure(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'cassette.json.gz')
+            Cassette(filename, Cassette.RECORD).save()
+
+            cassette = Cassette(filename, Cassette.REPLAY)
+            self.assertEqual(GOVUK(cassette=cassette).get_smart_answers(), None)
+
+    def _pp(self, cassette):
+        return PerformancePlatform('foo',
+                                   start_date=date(2014, 12, 16),
+                                   end_date=date(2015, 01, 27),
+                                   cassette=cassette)
+
+    def _fetch(self, cassette):
+        pageviews = self._pp(cassette).get_unique_pageviews(["/am-i-getting-minimum-wag€"])
+        answers = GOVUK(cassette=cassette).get_smart_answers()
+        return pageviews, answers
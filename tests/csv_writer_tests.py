@@ -19,6 +19,7 @@ class TestCSVWriter(unittest.TestCase):
 
         expected_filename = 'report_2015-02-03_2015-03-06.csv'
         self.assertEqual(writer.output_filename, expected_filename)
+        self.assertEqual(writer.variants_filename, 'path_variants_2015-02-03_2015-03-06.csv')
 
     def test_writing_csv(self):
         datapoints = [
@@ -27,9 +28,9 @@ class TestCSVWriter(unittest.TestCase):
         ]
 
         expected_csv_lines = [
-            'uniquePageviews,problemReports,searchUniques,pagePath,_id,problemsPer100kViews,searchesPer100kViews',
-            '10,2,5,/path1,_path1,20000.0,50000.0',
-            '10,2,5,/path2,_path2,20000.0,50000.0',
+            'uniquePageviews,problemReports,searchUniques,pagePath,_id,problemsPer100kViews,searchesPer100kViews,pageviewsFetched,pageviewsEstimated,uniquePageviewsLower,uniquePageviewsUpper',
+            '10,2,5,/path1,_path1,20000.0,50000.0,True,False,,',
+            '10,2,5,/path2,_path2,20000.0,50000.0,True,False,,',
         ]
 
         with TemporaryDirectory() as tempdir:
@@ -40,3 +41,19 @@ class TestCSVWriter(unittest.TestCase):
             with open(csv_filename, 'r') as open_file:
                 file_lines = open_file.read().splitlines()
                 self.assertEqual(file_lines, expected_csv_lines)
+
+    def test_writing_path_variants(self):
+        expected_csv_lines = [
+            'canonicalPath,pagePath',
+            '/tax,/Tax',
+            '/vat,/vat/',
+            '/vat,/vat?q=rates',
+        ]
+
+        with TemporaryDirectory() as tempdir:
+            csv_filename = os.path.join(tempdir, 'test_variants.csv')
+            writer = CSVWriter(output_filename='unused.csv', variants_filename=csv_filename)
+            writer.write_path_variants({'/vat': ['/vat/', '/vat?q=rates'], '/tax': ['/Tax']})
+
+            with open(csv_filename, 'r') as open_file:
+                self.assertEqual(open_file.read().splitlines(), expected_csv_lines)
@@ -0,0 +1,145 @@
+from datetime import date
+import json
+import logging
+import threading
+import unittest
+import urllib2
+
+from mock import Mock, patch
+
+from .helpers import build_datapoint_with_counts
+from stats.daemon import StatsDaemon, StatusRequestHandler
+from stats.data import SmartAnswer
+from stats.info_statistics import InfoStatistics
+import settings
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestStatsDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = StatsDaemon('foo', interval=60)
+        self.daemon.govuk_adapter = Mock()
+        self.daemon.govuk_adapter.get_smart_answers.return_value = [SmartAnswer('/sa')]
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_successful_run_updates_status_and_results(self, info_statistics):
+        info_statistics.return_value.aggregated_datapoints = [build_datapoint_with_counts('/abc')]
+
+        self.assertTrue(self.daemon.run_once())
+
+        status = self.daemon.get_status()
+        self.assertEqual(status['state'], 'idle')
+        self.assertEqual(status['runs'], 1)
+        self.assertEqual(status['failures'], 0)
+        self.assertEqual([dp['pagePath'] for dp in self.daemon.get_latest_datapoints()], ['/abc'])
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_failed_run_keeps_previous_results(self, info_statistics):
+        info_statistics.return_value.aggregated_datapoints = [build_datapoint_with_counts('/abc')]
+        self.daemon.run_once()
+
+        info_statistics.return_value.process_data.side_effect = ValueError('PP is down')
+        self.daemon.run_once()
+
+        status = self.daemon.get_status()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['last_error'], 'PP is down')
+        self.assertEqual(status['failures'], 1)
+        self.assertEqual(len(self.daemon.get_latest_datapoints()), 1)
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_runs_do_not_overlap(self, info_statistics):
+        self.daemon.run_lock.acquire()
+        try:
+            self.assertFalse(self.daemon.run_once())
+        finally:
+            self.daemon.run_lock.release()
+        self.assertFalse(info_statistics.called)
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_smart_answers_are_kept_between_runs(self, info_statistics):
+        self.daemon.run_once()
+        self.daemon.run_once()
+
+        self.assertEqual(self.daemon.govuk_adapter.get_smart_answers.call_count, 1)
+        info_statistics.return_value.process_data.assert_called_with(
+            smart_answers=[SmartAnswer('/sa')])
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_smart_answers_are_kept_if_a_refresh_fails(self, info_statistics):
+        self.daemon.smart_answers_ttl = 0
+        self.daemon.run_once()
+        self.daemon.govuk_adapter.get_smart_answers.return_value = None
+        self.daemon.run_once()
+
+        info_statistics.return_value.process_data.assert_called_with(
+            smart_answers=[SmartAnswer('/sa')])
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_circuit_breakers_are_kept_between_runs(self, info_statistics):
+        self.daemon.run_once()
+        self.daemon.run_once()
+
+        self.assertIs(info_statistics.return_value.pp_adapter.circuit_breakers,
+                      self.daemon.circuit_breakers)
+        self.assertIs(info_statistics.return_value.pp_adapter.latency_trackers,
+                      self.daemon.latency_trackers)
+
+    def test_status_is_served_over_http(self):
+        from BaseHTTPServer import HTTPServer
+
+        server = HTTPServer(('127.0.0.1', 0), StatusRequestHandler)
+        server.stats_daemon = self.daemon
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{0}/status'.format(server.server_address[1])
+            status = json.load(urllib2.urlopen(url))
+        finally:
+            server.shutdown()
+
+        self.assertEqual(status['state'], 'idle')
+        self.assertEqual(status['runs'], 0)
+
+
+class TestPageviewReuse(unittest.TestCase):
+
+    @patch('stats.daemon.InfoStatistics')
+    def test_pageviews_are_only_reused_on_the_same_day(self, info_statistics):
+        daemon = StatsDaemon('foo')
+        daemon.govuk_adapter = Mock()
+        runs = [Mock(), Mock(), Mock()]
+        for run, end_date in zip(runs, ['2015-01-27', '2015-01-27', '2015-01-28']):
+            run.pp_adapter.start_date = '2014-12-16T00:00:00Z'
+            run.pp_adapter.end_date = end_date + 'T00:00:00Z'
+            run.previous_pageviews = {}
+        info_statistics.side_effect = runs
+
+        for _ in runs:
+            daemon.run_once()
+
+        self.assertEqual(runs[1].previous_pageviews, runs[0].unique_pageviews)
+        self.assertEqual(runs[2].previous_pageviews, {})
+
+    def test_default_interval_reuses_pageviews(self):
+        self.assertTrue(settings.DAEMON_INTERVAL < 24 * 60 * 60)
+
+    def test_previous_pageviews_are_not_fetched_again(self):
+        info = InfoStatistics('foo',
+                              start_date=date(2014, 12, 16),
+                              end_date=date(2015, 01, 27),
+                              previous_pageviews={'/abc': 1000})
+        info.pp_adapter = Mock()
+        info.pp_adapter.get_unique_pageviews.return_value = {'/def': 2000}
+
+        pageviews = info._get_unique_pageviews(['/abc', '/def'], [])
+
+        info.pp_adapter.get_unique_pageviews.assert_called_once_with(
+            ['/def'], [], priorities=None, deadline=None)
+        self.assertEqual(pageviews, {'/abc': 1000, '/def': 2000})
+        self.assertEqual(info.unique_pageviews, pageviews)
@@ -2,7 +2,9 @@ import logging
 import unittest
 
 from .helpers import build_datapoint_with_counts
-from stats.data import AggregatedDataset
+from stats.data import (AggregatedDataset, AggregatedDatasetCombiningSmartAnswers, Datapoint,
+                        SmartAnswer, SpillingAggregatedDataset)
+from stats.estimation import PageviewEstimate
 
 
 # Prevent info/debug logging cluttering up test output
@@ -19,9 +21,24 @@ class TestDatapoint(unittest.TestCase):
         self.assertEqual(10, self.datapoint.get_pageview_count())
         self.assertEqual('/i/am/a path', self.datapoint.get_path())
 
+    def test_fields_come_from_the_metrics(self):
+        self.assertEqual(Datapoint.all_fields,
+                         ['uniquePageviews', 'problemReports', 'searchUniques', 'pagePath',
+                          '_id', 'problemsPer100kViews', 'searchesPer100kViews',
+                          'pageviewsFetched', 'pageviewsEstimated',
+                          'uniquePageviewsLower', 'uniquePageviewsUpper'])
+        self.datapoint.set_count('searchUniques', 7)
+        self.assertEqual(7, self.datapoint.get_search_count())
+
     def test_id_replaces_slashes_and_spaces(self):
         self.assertEqual('_i_am_a%20path', self.datapoint['_id'])
 
+    def test_estimation_ranges_are_not_posted(self):
+        self.assertEqual(Datapoint.posted_fields,
+                         ['uniquePageviews', 'problemReports', 'searchUniques', 'pagePath',
+                          '_id', 'problemsPer100kViews', 'searchesPer100kViews',
+                          'pageviewsFetched', 'pageviewsEstimated'])
+
     def test_as_dict(self):
         expected_dict = {
             '_id': '_i_am_a%20path',
@@ -31,6 +48,10 @@ class TestDatapoint(unittest.TestCase):
             'searchUniques': 5,
             'searchesPer100kViews': 50000.0,
             'uniquePageviews': 10,
+            'pageviewsFetched': True,
+            'pageviewsEstimated': False,
+            'uniquePageviewsLower': None,
+            'uniquePageviewsUpper': None,
         }
         self.assertEqual(expected_dict, self.datapoint.as_dict())
 
@@ -79,3 +100,98 @@ class TestAggregatedDataset(unittest.TestCase):
 
         self.assertEqual(aggregated_points["/def"]["searchesPer100kViews"], 125.0)
         self.assertEqual(aggregated_points["/xyz"]["searchesPer100kViews"], 125.0)
+
+    def test_pageview_estimates(self):
+        aggregate = AggregatedDataset()
+        aggregate.add_problem_report_counts({'/abc': 2})
+        aggregate.add_pageview_estimates({'/abc': PageviewEstimate(1000, 9000)})
+        datapoint = aggregate.get_aggregated_datapoints()['/abc']
+
+        self.assertEqual(datapoint['uniquePageviews'], None)
+        self.assertEqual(datapoint['problemsPer100kViews'], None)
+        self.assertEqual(datapoint['pageviewsEstimated'], True)
+        self.assertEqual(datapoint.get_pageview_interval(), (1000, 9000))
+
+
+class TestSmartAnswer(unittest.TestCase):
+    def test_combined_interval_is_the_maximum(self):
+        exact = build_datapoint_with_counts('/sa/a')
+        exact.set_pageview_count(5000)
+        estimated = build_datapoint_with_counts('/sa/b')
+        estimated.set_pageview_estimate(PageviewEstimate(1000, 6000))
+
+        combined = SmartAnswer('/sa').combine_datapoints([exact, estimated])
+
+        self.assertEqual(combined.get_pageview_count(), None)
+        self.assertTrue(combined.is_pageview_estimate())
+        self.assertEqual(combined.get_pageview_interval(), (5000, 6000))
+
+    def test_combined_pageviews_are_unknown_without_a_range(self):
+        exact = build_datapoint_with_counts('/sa/a')
+        estimated = build_datapoint_with_counts('/sa/b')
+        estimated.set_pageview_estimate(PageviewEstimate(None, None))
+
+        combined = SmartAnswer('/sa').combine_datapoints([exact, estimated])
+
+        self.assertTrue(combined.is_pageview_estimate())
+        self.assertEqual(combined.get_pageview_interval(), (10, None))
+
+    def test_combined_pageviews_are_exact_if_above_every_estimate(self):
+        exact = build_datapoint_with_counts('/sa/a')
+        exact.set_pageview_count(5000)
+        estimated = build_datapoint_with_counts('/sa/b')
+        estimated.set_pageview_estimate(PageviewEstimate(1000, 4000))
+
+        combined = SmartAnswer('/sa').combine_datapoints([exact, estimated])
+
+        self.assertEqual(combined.get_pageview_count(), 5000)
+        self.assertFalse(combined.is_pageview_estimate())
+        self.assertEqual(combined['problemsPer100kViews'], 80.0)
+
+
+class TestSpillingAggregatedDataset(unittest.TestCase):
+    def _add_counts(self, aggregate):
+        aggregate.add_problem_report_counts({'/abc': 2, '/def': 3.0, '/gh\xe2\x82\xac': 1})
+        aggregate.add_search_counts({'/def': 5, '/xyz': 10})
+        aggregate.add_unique_pageviews({'/abc': 2000, '/def': 4000, '/xyz': None})
+        return {path: dp.as_dict() for path, dp in aggregate.get_aggregated_datapoints().items()}
+
+    def test_same_results_as_in_memory_dataset(self):
+        expected = self._add_counts(AggregatedDataset())
+
+        for max_entries in (1, 2, 3, 10):
+            aggregate = SpillingAggregatedDataset(max_entries)
+            self.assertEqual(self._add_counts(aggregate), expected)
+            self.assertTrue(len(aggregate.entries) <= max_entries)
+
+    def test_spilled_datapoint_is_moved_back_into_memory(self):
+        aggregate = SpillingAggregatedDataset(1)
+        aggregate.add_problem_report_counts({'/abc': 2})
+        aggregate.add_problem_report_counts({'/def': 3})
+        self.assertEqual(aggregate.entries.keys(), ['/def'])
+
+        aggregate.add_search_counts({'/abc': 5})
+        self.assertEqual(aggregate.entries.keys(), ['/abc'])
+        self.assertEqual(aggregate.entries['/abc'].get_problem_reports_count(), 2)
+        self.assertEqual(aggregate.entries['/abc'].get_search_count(), 5)
+
+    def test_aggregation_stays_within_the_budget(self):
+        paths = ['/page-{0}'.format(i) for i in range(10)] + ['/sa/{0}'.format(i) for i in range(10)]
+        counts = {path: 1 for path in paths}
+
+        def aggregate(max_entries):
+            dataset = AggregatedDatasetCombiningSmartAnswers([SmartAnswer('/sa')], max_entries)
+            dataset.add_problem_report_counts(counts)
+            dataset.add_unique_pageviews(counts)
+            return dataset
+
+        expected = {dp.get_path(): dp.as_dict()
+                    for dp in aggregate(None).iter_aggregated_datapoints()}
+        dataset = aggregate(2)
+        aggregated = {}
+        for datapoint in dataset.iter_aggregated_datapoints():
+            self.assertTrue(len(dataset.underlying_dataset.entries) <= 2)
+            aggregated[datapoint.get_path()] = datapoint.as_dict()
+
+        self.assertEqual(aggregated, expected)
+        self.assertEqual(aggregated['/sa']['problemReports'], 10)
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+from datetime import date
+import logging
+import os
+import unittest
+
+from mock import Mock
+
+from .helpers import TemporaryDirectory
+from stats.empty_paths import EmptyPathIndex
+from stats.info_statistics import InfoStatistics
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+DAY = 24 * 60 * 60
+
+
+def build_index(filename, recheck_rate=0.0, random_value=0.5):
+    random_generator = Mock()
+    random_generator.random.return_value = random_value
+    return EmptyPathIndex(filename, expiry_days=14, recheck_rate=recheck_rate,
+                          random_generator=random_generator)
+
+
+class TestEmptyPathIndex(unittest.TestCase):
+
+    def test_empty_paths_are_skipped_until_they_expire(self):
+        with TemporaryDirectory() as tempdir:
+            index = build_index(os.path.join(tempdir, 'empty_paths.json'))
+            index.update({'/typo': None, '/page': 100}, now=1000)
+
+            self.assertEqual(index.paths_to_skip(['/typo', '/page', '/new'], now=1000 + DAY),
+                             set(['/typo']))
+            self.assertEqual(index.paths_to_skip(['/typo'], now=1000 + 14 * DAY), set())
+
+    def test_sampled_paths_are_rechecked(self):
+        with TemporaryDirectory() as tempdir:
+            index = build_index(os.path.join(tempdir, 'empty_paths.json'),
+                                recheck_rate=0.05, random_value=0.01)
+            index.update({'/typo': None}, now=1000)
+
+            self.assertEqual(index.paths_to_skip(['/typo'], now=1000), set())
+
+    def test_paths_with_pageviews_are_forgotten(self):
+        with TemporaryDirectory() as tempdir:
+            index = build_index(os.path.join(tempdir, 'empty_paths.json'))
+            index.update({'/typo': None}, now=1000)
+            index.update({'/typo': 5}, now=2000)
+
+            self.assertEqual(index.paths_to_skip(['/typo'], now=2000), set())
+
+    def test_save_and_load(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'empty_paths.json')
+            index = build_index(filename)
+            index.update({'/typ€': None}, now=1000)
+            index.update({'/old': None}, now=1000 - 14 * DAY)
+            index.save(now=1000)
+
+            loaded = build_index(filename)
+
+        self.assertEqual(loaded.checked_at, {'/typ€': 1000})
+
+
+class TestInfoStatisticsEmptyPaths(unittest.TestCase):
+
+    def test_known_empty_paths_are_not_fetched(self):
+        with TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'empty_paths.json')
+            index = build_index(filename)
+            index.update({'/typo': None})
+
+            info = InfoStatistics('foo',
+                                  start_date=date(2014, 12, 16),
+                                  end_date=date(2015, 01, 27),
+                                  empty_paths=index)
+            info.pp_adapter = Mock()
+            info.pp_adapter.get_unique_pageviews.return_value = {'/page': 100, '/removed': None}
+
+            pageviews = info._get_unique_pageviews(['/page', '/removed', '/typo'], [])
+
+            self.assertEqual(info.pp_adapter.get_unique_pageviews.call_args[0][0],
+                             ['/page', '/removed'])
+            self.assertEqual(pageviews, {'/page': 100, '/removed': None, '/typo': None})
+            self.assertEqual(build_index(filename).paths_to_skip(['/page', '/removed', '/typo']),
+                             set(['/removed', '/typo']))
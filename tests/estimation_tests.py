@@ -0,0 +1,104 @@
+# coding=utf-8
+
+from datetime import date
+import logging
+import random
+import unittest
+
+from mock import Mock, mock_open, patch
+
+from stats.data import Datapoint, SmartAnswer
+from stats.estimation import LongTailEstimator, PageviewEstimate
+from stats.info_statistics import InfoStatistics
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestLongTailEstimator(unittest.TestCase):
+
+    def test_split_fetches_the_head_and_a_sample_of_the_tail(self):
+        estimator = LongTailEstimator(threshold=2, sample_rate=0.25,
+                                      random_generator=random.Random(1))
+        paths = ['/head', '/smart-answer/y'] + ['/tail-{0}'.format(i) for i in range(8)]
+        priorities = dict({'/head': 10, '/smart-answer/y': 1},
+                          **{path: 1 for path in paths[2:]})
+
+        to_fetch, sample, to_estimate = estimator.split(
+            paths, priorities, [SmartAnswer('/smart-answer')])
+
+        self.assertEqual(len(sample), 2)
+        self.assertEqual(len(to_estimate), 6)
+        self.assertEqual(sorted(to_fetch), sorted(['/head', '/smart-answer/y'] + sample))
+        self.assertEqual(set(sample + to_estimate), set(paths[2:]))
+
+    def test_split_without_a_long_tail(self):
+        estimator = LongTailEstimator(threshold=2, sample_rate=0.1)
+
+        self.assertEqual(estimator.split(['/a', '/b'], {'/a': 3, '/b': 5}),
+                         (['/a', '/b'], [], []))
+
+    def test_estimate_is_the_range_of_sampled_paths_with_the_same_count(self):
+        estimator = LongTailEstimator(threshold=2, sample_rate=0.1, confidence=50)
+        priorities = {'/s1': 1, '/s2': 1, '/s3': 1, '/s4': 1, '/s5': 2,
+                      '/e1': 1, '/e2': 2, '/e3': 0}
+        sampled_pageviews = {'/s1': 100, '/s2': 200, '/s3': 300, '/s4': None, '/s5': 600}
+
+        estimates = estimator.estimate(['/e1', '/e2', '/e3'], priorities, sampled_pageviews)
+
+        # The pageviews for a count of 1 are 0, 100, 200 and 300
+        self.assertEqual(estimates, {
+            '/e1': PageviewEstimate(100, 300),
+            '/e2': PageviewEstimate(600, 600),
+            '/e3': PageviewEstimate(None, None),
+        })
+
+    def test_no_range_without_a_sample(self):
+        estimator = LongTailEstimator(threshold=2, sample_rate=0.1)
+
+        self.assertEqual(estimator.estimate(['/e1'], {'/e1': 1}, {}),
+                         {'/e1': PageviewEstimate(None, None)})
+
+
+class TestInfoStatisticsEstimation(unittest.TestCase):
+
+    @patch('__builtin__.open', new=mock_open())
+    def test_long_tail_pageviews_are_sampled(self):
+        estimator = LongTailEstimator(threshold=1, sample_rate=0.5,
+                                      random_generator=random.Random(1))
+        info = InfoStatistics('foo',
+                              start_date=date(2014, 12, 16),
+                              end_date=date(2015, 01, 27),
+                              estimator=estimator)
+        info.pp_adapter = Mock()
+        info.pp_adapter.get_metric_counts.return_value = {
+            'problemReports': {'/head': 5, '/tail-a': 1, '/tail-b': 1},
+        }
+        info.pp_adapter.get_unique_pageviews.side_effect = (
+            lambda paths, *args, **kwargs: {path: 1000 for path in paths})
+
+        info.process_data(smart_answers=[])
+
+        fetched_paths = info.pp_adapter.get_unique_pageviews.call_args[0][0]
+        self.assertEqual(len(fetched_paths), 2)
+        self.assertIn('/head', fetched_paths)
+
+        datapoints = {dp.get_path(): dp for dp in info.aggregated_datapoints}
+        estimated = [path for path, dp in datapoints.iteritems() if dp.is_pageview_estimate()]
+        self.assertEqual(len(estimated), 1)
+        self.assertNotIn(estimated[0], info.unique_pageviews)
+        self.assertEqual(datapoints[estimated[0]].get_pageview_count(), None)
+        self.assertEqual(datapoints[estimated[0]].get_pageview_interval(), (1000, 1000))
+        self.assertEqual(datapoints[estimated[0]]['problemsPer100kViews'], None)
+
+        # The sampled path has its pageviews and rates
+        sampled = next(path for path in fetched_paths if path != '/head')
+        self.assertEqual(datapoints[sampled]['problemsPer100kViews'], 100.0)
+
+        posted = [datapoint.as_dict(Datapoint.posted_fields) for datapoint in
+                  info.pp_adapter.save_aggregated_results.call_args[0][0]]
+        estimated_row = next(row for row in posted if row['pagePath'] == estimated[0])
+        self.assertEqual(estimated_row['uniquePageviews'], None)
+        self.assertEqual(estimated_row['pageviewsEstimated'], True)
+        self.assertFalse(datapoints['/head'].is_pageview_estimate())
@@ -4,12 +4,14 @@ from datetime import date
 import json
 import logging
 import re
+import threading
 import unittest
 import urllib
 
-from mock import patch, mock_open
+from mock import Mock, patch, mock_open
 import responses
 
+from stats.data import SmartAnswer
 from stats.info_statistics import InfoStatistics
 
 
@@ -75,10 +77,27 @@ class TestInfoStatistics(unittest.TestCase):
         }
         """
 
+        smart_answer_page_statistics = """
+        {
+          "data": [
+            {
+              "pagePath": "/am-i-getting-minimum-wag€",
+              "uniquePageviews:sum": 2000.0
+            },
+            {
+              "pagePath": "/am-i-getting-minimum-wag€/y",
+              "uniquePageviews:sum": 500.0
+            },
+            {
+              "pagePath": "/am-i-getting-minimum-wag€/y/n",
+              "uniquePageviews:sum": 5000.0
+            }
+          ]
+        }
+        """
+
         expected_pageviews_calls = {
             "/academies-financial-returns": 1000,
-            "/am-i-getting-minimum-wag€": 2000,
-            "/am-i-getting-minimum-wag€/y": 500
         }
 
         smart_answers = """
@@ -119,6 +138,13 @@ class TestInfoStatistics(unittest.TestCase):
                       body='[]', status=200,
                       content_type='application/json')
 
+        url_re = re.compile(
+            r'https://www.performance.service.gov.uk/data/govuk-info/page-statistics.*?filter_by_prefix=' + urllib.quote("pagePath:/am-i-getting-minimum-wag€", "")
+        )
+        responses.add(responses.GET, url_re,
+                      body=smart_answer_page_statistics, status=200,
+                      content_type='application/json')
+
         for path, pageview in expected_pageviews_calls.iteritems():
             url_re = re.compile(
                 r'https://www.performance.service.gov.uk/data/govuk-info/page-statistics.*?' + urllib.quote("pagePath:" + path, "") + ".*?"
@@ -144,10 +170,11 @@ class TestInfoStatistics(unittest.TestCase):
         # we're expecting:
         # - 26 GETs to PP: search terms (one for each letter of the alphabet)
         # - 26 GETs to PP: page contacts (one for each letter of the alphabet)
-        # - 1 GET to PP: page statistics
+        # - 2 GETs to PP: page statistics (one for the academies page, and
+        #   one for all pages of the smart answer)
         # - 1 GET to the GOV.UK content API
         # - 1 POST to PP: info-statistics
-        self.assertEqual(len(responses.calls), 57)
+        self.assertEqual(len(responses.calls), 56)
 
         expectedAggregateReport = [
           {
@@ -160,7 +187,9 @@ class TestInfoStatistics(unittest.TestCase):
             u"pagePath": u"/am-i-getting-minimum-wag€",
             u"searchUniques": 3.0,
             u"problemReports": 4.0,
-            u"uniquePageviews": 2000
+            u"uniquePageviews": 2000,
+            u"pageviewsFetched": True,
+            u"pageviewsEstimated": False
           },
           {
             u"_id": u"_academies-financial-returns",
@@ -172,9 +201,70 @@ class TestInfoStatistics(unittest.TestCase):
             u"pagePath": u"/academies-financial-returns",
             u"searchUniques": 10.0,
             u"problemReports": 5.0,
-            u"uniquePageviews": 1000
+            u"uniquePageviews": 1000,
+            u"pageviewsFetched": True,
+            u"pageviewsEstimated": False
           }
         ]
 
+        # The order of the results doesn't matter
         posted_body = json.loads(responses.calls[-1].request.body)
-        self.assertEqual(posted_body, expectedAggregateReport)
+        self.assertEqual(sorted(posted_body, key=lambda result: result['_id']),
+                         sorted(expectedAggregateReport, key=lambda result: result['_id']))
+
+    @patch('__builtin__.open', new=mock_open())
+    def test_paths_without_pageviews_by_the_deadline_are_marked(self):
+        info = InfoStatistics('foo',
+                              start_date=date(2014, 12, 16),
+                              end_date=date(2015, 01, 27),
+                              deadline=60)
+        info.pp_adapter = Mock()
+        info.pp_adapter.get_metric_counts.return_value = {
+            'problemReports': {'/a': 5, '/b': 1},
+            'searchUniques': {'/b': 1},
+        }
+        info.pp_adapter.get_unique_pageviews.return_value = {'/a': 1000}
+
+        info.process_data(smart_answers=[])
+
+        call_kwargs = info.pp_adapter.get_unique_pageviews.call_args[1]
+        self.assertEqual(call_kwargs['priorities'], {'/a': 5, '/b': 2})
+        self.assertEqual(call_kwargs['deadline'], info.deadline_at)
+
+        fetched = {dp.get_path(): dp.get_pageviews_fetched()
+                   for dp in info.aggregated_datapoints}
+        self.assertEqual(fetched, {'/a': True, '/b': False})
+        self.assertTrue(info.pp_adapter.save_aggregated_results.called)
+
+    @patch('__builtin__.open', new=mock_open())
+    def test_results_are_the_same_within_a_memory_budget(self):
+        def run():
+            info = InfoStatistics('foo',
+                                  start_date=date(2014, 12, 16),
+                                  end_date=date(2015, 01, 27))
+            info.pp_adapter = Mock()
+            info.pp_adapter.get_metric_counts.return_value = {
+                'problemReports': {'/a': 5, '/b': 1, '/sa/x': 2, '/sa/y': 3},
+            }
+            info.pp_adapter.get_unique_pageviews.return_value = {
+                '/a': 1000, '/b': 10, '/sa/x': 500, '/sa/y': 400}
+            info.process_data(smart_answers=[SmartAnswer('/sa')])
+            return info
+
+        def results(info):
+            # Read from another thread, as the daemon's HTTP server does
+            results = {}
+            thread = threading.Thread(target=lambda: results.update(
+                (dp.get_path(), dp.as_dict()) for dp in info.aggregated_datapoints))
+            thread.start()
+            thread.join()
+            return results
+
+        expected = results(run())
+        with patch('settings.AGGREGATION_MAX_ENTRIES', 1):
+            info = run()
+
+        self.assertEqual(results(info), expected)
+        self.assertEqual(sorted(dp.get_path() for dp in
+                                info.pp_adapter.save_aggregated_results.call_args[0][0]),
+                         ['/a', '/b', '/sa'])
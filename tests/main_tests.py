@@ -0,0 +1,73 @@
+from datetime import date
+import logging
+import unittest
+
+from mock import patch
+
+from stats import main
+import settings
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestMain(unittest.TestCase):
+
+    def test_run_is_the_default_command(self):
+        self.assertEqual(main.parse_args([]).command, 'run')
+
+    @patch('stats.main.run_command')
+    def test_run_needs_a_token(self, run_command):
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertEqual(main.main(['run']), main.missing_token_message())
+        self.assertFalse(run_command.called)
+
+    @patch('settings.configure_logging')
+    @patch('stats.main.run_command')
+    def test_report_only_does_not_need_a_token(self, run_command, configure_logging):
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertEqual(main.main(['report-only']), None)
+        self.assertEqual(run_command.call_args[0][0].command, 'report-only')
+
+    def test_daemon_needs_a_token_unless_report_only(self):
+        self.assertTrue(main.needs_token(main.parse_args(['daemon'])))
+        self.assertFalse(main.needs_token(main.parse_args(['daemon', '--report-only'])))
+
+    def test_cassette_options_are_mutually_exclusive(self):
+        with patch('sys.stderr'):
+            self.assertRaises(SystemExit, main.parse_args,
+                              ['run', '--record-cassette', 'a', '--replay-cassette', 'b'])
+
+    @patch('stats.info_statistics.InfoStatistics')
+    @patch('stats.main.build_cassette')
+    def test_replay_covers_the_recorded_dates(self, build_cassette, InfoStatistics):
+        cassette = build_cassette.return_value
+        cassette.replaying = True
+        cassette.start_date = date(2014, 12, 16)
+        cassette.end_date = date(2015, 01, 27)
+
+        main.run_command(main.parse_args(['report-only', '--replay-cassette', 'a']))
+
+        _, kwargs = InfoStatistics.call_args
+        self.assertEqual((kwargs['start_date'], kwargs['end_date']),
+                         (date(2014, 12, 16), date(2015, 01, 27)))
+
+
+class TestSettings(unittest.TestCase):
+
+    def tearDown(self):
+        settings.load({})
+
+    def test_load_reads_the_environment(self):
+        settings.load({'PP_DATA_DOMAIN': 'http://pp.example/data',
+                       'PP_DATASET_TOKEN': 'token',
+                       'LOG_LEVEL': 'debug'})
+        self.assertEqual(settings.DATA_DOMAIN, 'http://pp.example/data')
+        self.assertEqual(settings.PP_TOKEN, 'token')
+        self.assertEqual(settings.LOG_LEVEL, 'DEBUG')
+
+    def test_load_defaults(self):
+        settings.load({})
+        self.assertEqual(settings.DATA_DOMAIN, settings.DEFAULT_DATA_DOMAIN)
+        self.assertEqual(settings.PP_TOKEN, None)
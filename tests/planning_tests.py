@@ -0,0 +1,58 @@
+import logging
+import unittest
+
+from stats.data import SmartAnswer
+from stats.metrics import BY_LETTER, Metric, PROBLEM_REPORTS, SEARCHES
+from stats.planning import MetricFetchPlan, PageviewFetchPlan
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestPageviewFetchPlan(unittest.TestCase):
+
+    def test_smart_answer_pages_are_grouped_by_prefix(self):
+        plan = PageviewFetchPlan(['/a', '/sa', '/sa/y', '/sa/y/n', '/other-sa', '/z'],
+                                 [SmartAnswer('/sa'), SmartAnswer('/other-sa')])
+
+        self.assertEqual(plan.prefix_groups, {'/sa': ['/sa', '/sa/y', '/sa/y/n']})
+        self.assertEqual(plan.single_paths, ['/a', '/other-sa', '/z'])
+        self.assertEqual(plan.path_count, 6)
+        self.assertEqual(plan.request_count, 4)
+
+    def test_most_specific_smart_answer_is_used(self):
+        plan = PageviewFetchPlan(['/sa/x', '/sa/x/y', '/sa/z', '/sa'],
+                                 [SmartAnswer('/sa'), SmartAnswer('/sa/x')])
+
+        self.assertEqual(plan.prefix_groups, {'/sa': ['/sa/z', '/sa'],
+                                              '/sa/x': ['/sa/x', '/sa/x/y']})
+
+    def test_fetches_are_ordered_by_priority(self):
+        plan = PageviewFetchPlan(['/a', '/b', '/c', '/sa', '/sa/y'],
+                                 [SmartAnswer('/sa')],
+                                 priorities={'/a': 1, '/b': 10, '/sa': 3, '/sa/y': 4})
+
+        self.assertEqual(plan.fetches, [(None, ['/b']),
+                                        ('/sa', ['/sa', '/sa/y']),
+                                        (None, ['/a']),
+                                        (None, ['/c'])])
+
+    def test_without_smart_answers_every_path_is_fetched(self):
+        plan = PageviewFetchPlan(['/b', '/a'])
+
+        self.assertEqual(plan.prefix_groups, {})
+        self.assertEqual(plan.single_paths, ['/a', '/b'])
+
+
+class TestMetricFetchPlan(unittest.TestCase):
+
+    def test_metrics_from_the_same_dataset_share_queries(self):
+        search_terms = Metric('searchTerms', 'search-terms', 'searchTerms:sum', fetch=BY_LETTER)
+        plan = MetricFetchPlan([PROBLEM_REPORTS, SEARCHES, search_terms])
+
+        self.assertEqual(plan.request_count, 52)
+        queries = list(plan.queries())
+        self.assertEqual(len(queries), 52)
+        self.assertEqual(queries[0], ('page-contacts', [PROBLEM_REPORTS], '/a'))
+        self.assertEqual(queries[-1], ('search-terms', [SEARCHES, search_terms], '/z'))
@@ -0,0 +1,47 @@
+import logging
+import os
+import pstats
+import unittest
+
+from .helpers import TemporaryDirectory
+from stats.profiling import Profiler, SUMMARY_FILENAME
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class Allocated(object):
+    pass
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_disabled_profiler_writes_nothing(self):
+        profiler = Profiler()
+        with profiler.stage('aggregation'):
+            pass
+        profiler.write_summary()
+
+        self.assertFalse(profiler.enabled)
+        self.assertEqual(profiler.stage_profiles, [])
+
+    def test_stage_profile_and_allocation_summary(self):
+        with TemporaryDirectory() as tempdir:
+            profile_dir = os.path.join(tempdir, 'profile')
+            profiler = Profiler(profile_dir)
+
+            with profiler.stage('aggregation'):
+                allocated = [Allocated() for _ in range(1000)]
+            profiler.write_summary()
+
+            pstats.Stats(os.path.join(profile_dir, 'aggregation.prof'))
+
+            stage_profile = profiler.stage_profiles[0]
+            self.assertEqual(stage_profile.name, 'aggregation')
+            self.assertTrue(stage_profile.object_growth['Allocated'] >= 1000)
+
+            with open(os.path.join(profile_dir, SUMMARY_FILENAME)) as summary:
+                lines = summary.read().splitlines()
+            self.assertTrue(lines[0].startswith('aggregation: '))
+            self.assertTrue(any(line.endswith(' Allocated') for line in lines[1:]))
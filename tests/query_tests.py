@@ -0,0 +1,88 @@
+import logging
+import os
+import unittest
+
+from .helpers import TemporaryDirectory
+from stats.csv_writer import CSVWriter
+from stats.data import Datapoint
+from stats.estimation import PageviewEstimate
+from stats.query import PrefixIndex
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+def build_datapoint(path, pageviews, problem_reports, searches):
+    datapoint = Datapoint(path)
+    datapoint.set_pageview_count(pageviews)
+    datapoint.set_problem_reports_count(problem_reports)
+    datapoint.set_search_count(searches)
+    return datapoint
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.datapoints = [
+            build_datapoint('/browse/benefits', 1000, 1, 10),
+            build_datapoint('/browse/benefits-other', 5000, 5, 50),
+            build_datapoint('/browse/benefits/tax-credits', 3000, 2, 20),
+            build_datapoint('/browse/benefits/universal-credit', None, 4, 0),
+            build_datapoint('/government/publications/a', 2000, 3, 30),
+        ]
+        self.index = PrefixIndex(self.datapoints)
+
+    def test_subtree_includes_the_path_and_the_pages_under_it(self):
+        subtree = self.index.subtree('/browse/benefits')
+
+        self.assertEqual(subtree.get_path(), '/browse/benefits')
+        self.assertEqual(subtree.get_pageview_count(), 4000)
+        self.assertEqual(subtree.get_problem_reports_count(), 7)
+        self.assertEqual(subtree.get_search_count(), 30)
+        # The 4 problem reports of universal-credit, which has no pageviews,
+        # are in the total but not the rate
+        self.assertEqual(subtree['problemsPer100kViews'], 75.0)
+        self.assertEqual(subtree['searchesPer100kViews'], 750.0)
+        self.assertEqual(self.index.page_count('/browse/benefits'), 3)
+
+    def test_estimated_pageviews_are_not_rated(self):
+        estimated = build_datapoint('/browse/benefits/child-benefit', None, 1, 5)
+        estimated.set_pageview_estimate(PageviewEstimate(100, 900))
+        index = PrefixIndex(self.datapoints + [estimated])
+
+        subtree = index.subtree('/browse/benefits')
+
+        self.assertEqual(subtree.get_pageview_count(), 4000)
+        self.assertEqual(subtree.get_problem_reports_count(), 8)
+        self.assertEqual(subtree['problemsPer100kViews'], 75.0)
+        self.assertEqual(subtree['searchesPer100kViews'], 750.0)
+
+    def test_subtree_without_a_page_for_the_path(self):
+        subtree = self.index.subtree('/government/publications/')
+
+        self.assertEqual(subtree.get_pageview_count(), 2000)
+        self.assertEqual(self.index.page_count('/government/publications'), 1)
+
+    def test_root_covers_everything(self):
+        self.assertEqual(self.index.page_count('/'), 5)
+        self.assertEqual(self.index.subtree('/').get_problem_reports_count(), 15)
+
+    def test_unknown_path(self):
+        self.assertEqual(self.index.page_count('/nothing'), 0)
+        self.assertEqual(self.index.subtree('/nothing')['problemsPer100kViews'], None)
+
+    def test_from_csv(self):
+        estimated = build_datapoint('/browse/benefits/child-benefit', None, 1, 5)
+        estimated.set_pageview_estimate(PageviewEstimate(100, 900))
+        self.datapoints.append(estimated)
+        self.index = PrefixIndex(self.datapoints)
+
+        with TemporaryDirectory() as tempdir:
+            csv_filename = os.path.join(tempdir, 'test_report.csv')
+            CSVWriter(output_filename=csv_filename).write_datapoints(self.datapoints)
+
+            index = PrefixIndex.from_csv(csv_filename)
+
+        self.assertEqual(index.subtree('/browse/benefits').as_dict(),
+                         self.index.subtree('/browse/benefits').as_dict())
@@ -0,0 +1,195 @@
+from datetime import date
+import logging
+import threading
+import unittest
+
+from mock import Mock, patch
+from requests.exceptions import ConnectionError
+
+from stats.api import PerformancePlatform
+from stats.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged_call
+
+
+# Prevent info/debug logging cluttering up test output
+logging.disable(logging.INFO)
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_percentile(self):
+        tracker = LatencyTracker()
+        self.assertEqual(tracker.percentile(95), None)
+
+        for seconds in range(1, 101):
+            tracker.record(seconds)
+        self.assertEqual(tracker.percentile(95), 96)
+        self.assertEqual(tracker.percentile(100), 100)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('page-statistics', error_rate=0.5,
+                                      min_requests=4, reset_seconds=30)
+
+    def test_opens_once_the_error_rate_is_reached(self):
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open)
+
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.assertRaises(CircuitOpenError, self.breaker.before_request)
+
+    def test_trial_request_after_the_reset_period(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+        self.breaker.opened_at -= 30
+
+        self.breaker.before_request()
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open)
+
+    def test_failed_trial_request_keeps_the_circuit_open(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+        self.breaker.opened_at -= 30
+
+        self.breaker.before_request()
+        self.breaker.record_failure()
+        self.assertRaises(CircuitOpenError, self.breaker.before_request)
+
+
+class TestHedgedCall(unittest.TestCase):
+
+    def test_slow_call_is_hedged(self):
+        first_call_started = threading.Event()
+        release_first_call = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                first_call_started.set()
+                release_first_call.wait(5)
+                return 'slow'
+            return 'fast'
+
+        try:
+            self.assertEqual(hedged_call(func, 0.01), 'fast')
+        finally:
+            release_first_call.set()
+        self.assertEqual(len(calls), 2)
+
+    def test_fast_failure_is_not_hedged(self):
+        func = Mock(side_effect=ValueError('bad request'))
+
+        self.assertRaises(ValueError, hedged_call, func, 5)
+        self.assertEqual(func.call_count, 1)
+
+    def test_no_hedging_without_a_delay(self):
+        func = Mock(return_value='result')
+
+        self.assertEqual(hedged_call(func, None), 'result')
+        self.assertEqual(func.call_count, 1)
+
+
+class TestPerformancePlatformCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.pp = PerformancePlatform('foo',
+                                      start_date=date(2014, 12, 16),
+                                      end_date=date(2015, 01, 27))
+
+    @patch('settings.CIRCUIT_BREAKER_RESET_SECONDS', 0.01)
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_failing_backend_fails_fast_once_the_circuit_opens(self, data_set):
+        data_set.return_value.get.side_effect = ConnectionError('connection reset')
+        paths = ['/path-{0:02d}'.format(i) for i in range(50)]
+
+        self.assertRaises(CircuitOpenError, self.pp.get_unique_pageviews, paths)
+
+        # CIRCUIT_BREAKER_MIN_REQUESTS failures open the circuit, and then
+        # only one trial request is made after the reset period
+        self.assertEqual(data_set.return_value.get.call_count, 11)
+
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_occasional_failures_are_retried(self, data_set):
+        failures = {'/b': ConnectionError('connection reset')}
+
+        def get(query_parameters):
+            path = query_parameters['filter_by'][len('pagePath:'):]
+            if path in failures:
+                raise failures.pop(path)
+            return {'data': [{'uniquePageviews:sum': 10.0}]}
+        data_set.return_value.get.side_effect = get
+
+        pageviews = self.pp.get_unique_pageviews(['/a', '/b', '/c'])
+
+        self.assertEqual(pageviews, {'/a': 10, '/b': 10, '/c': 10})
+        self.assertEqual(data_set.return_value.get.call_count, 4)
+
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_paths_which_fail_again_are_left_unfetched(self, data_set):
+        def get(query_parameters):
+            if query_parameters['filter_by'] == 'pagePath:/b':
+                raise ConnectionError('connection reset')
+            return {'data': [{'uniquePageviews:sum': 10.0}]}
+        data_set.return_value.get.side_effect = get
+
+        pageviews = self.pp.get_unique_pageviews(['/a', '/b', '/c'])
+
+        self.assertEqual(pageviews, {'/a': 10, '/c': 10})
+
+    @patch('settings.CIRCUIT_BREAKER_MIN_REQUESTS', 2)
+    @patch('settings.CIRCUIT_BREAKER_RESET_SECONDS', 0.1)
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_pageviews_are_deferred_while_the_circuit_is_open(self, data_set):
+        failures = {'/a': ConnectionError('timeout'), '/b': ConnectionError('timeout')}
+
+        def get(query_parameters):
+            path = query_parameters['filter_by'][len('pagePath:'):]
+            if path in failures:
+                raise failures.pop(path)
+            return {'data': [{'uniquePageviews:sum': 10.0}]}
+        data_set.return_value.get.side_effect = get
+
+        pageviews = self.pp.get_unique_pageviews(['/a', '/b', '/c'])
+
+        # No request was made for /c while the circuit was open
+        self.assertEqual(data_set.return_value.get.call_count, 5)
+        self.assertEqual(pageviews, {'/a': 10, '/b': 10, '/c': 10})
+        self.assertFalse(self.pp.circuit_breakers['page-statistics'].is_open)
+
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_failed_count_queries_are_retried(self, data_set):
+        failures = {'pagePath:/q': ConnectionError('connection reset')}
+
+        def get(query_parameters):
+            prefix = query_parameters['filter_by_prefix']
+            if prefix in failures:
+                raise failures.pop(prefix)
+            return {'data': [{'pagePath': prefix[len('pagePath:'):] + 'x', 'total:sum': 1.0,
+                              'searchUniques:sum': 2.0}]}
+        data_set.return_value.get.side_effect = get
+
+        counts = self.pp.get_metric_counts()
+
+        self.assertEqual(len(counts['problemReports']), 26)
+        self.assertEqual(counts['problemReports']['/qx'], 1.0)
+
+    @patch('settings.CIRCUIT_BREAKER', False)
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_failures_are_raised_without_a_circuit_breaker(self, data_set):
+        data_set.return_value.get.side_effect = ConnectionError('connection reset')
+
+        self.assertRaises(ConnectionError, self.pp.get_unique_pageviews, ['/a', '/b'])
+        self.assertEqual(data_set.return_value.get.call_count, 1)
+
+    @patch.object(PerformancePlatform, '_data_set')
+    def test_other_errors_are_not_deferred(self, data_set):
+        data_set.side_effect = ImportError('No module named performanceplatform.client')
+
+        self.assertRaises(ImportError, self.pp.get_unique_pageviews, ['/a', '/b'])
+        self.assertEqual(data_set.call_count, 1)